@@ -0,0 +1,3 @@
+from backtester.cli import main
+
+main()
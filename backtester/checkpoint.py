@@ -0,0 +1,29 @@
+import gzip
+import os
+import pickle
+
+# Bump when the content of TradingAlgo.get_state changes
+CHECKPOINT_VERSION = 3
+
+
+def save_checkpoint(checkpoint_file:str, last_day, algo_state:dict):
+    """
+    Write a compressed snapshot of the algo state after last_day. The previous checkpoint
+    is only replaced once the new one is completely written.
+    """
+    os.makedirs(os.path.dirname(checkpoint_file) or ".", exist_ok=True)
+    snapshot = {"version": CHECKPOINT_VERSION, "last_day": last_day, "state": algo_state}
+
+    tmp_file = checkpoint_file + ".tmp"
+    with gzip.open(tmp_file, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def load_checkpoint(checkpoint_file:str) -> dict:
+    with gzip.open(checkpoint_file, "rb") as f:
+        snapshot = pickle.load(f)
+
+    if snapshot.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint version {snapshot.get('version')} is not supported (expected {CHECKPOINT_VERSION})")
+    return snapshot
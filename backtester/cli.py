@@ -0,0 +1,166 @@
+"""
+Command line entry point:
+
+    python -m backtester run [--resume] [--segments N]
+    python -m backtester sweep --grid instruments_number=5,10 --grid TAKE_PROFIT=0.004,0.006
+    python -m backtester download [--update]
+    python -m backtester convert-data --to cache|store
+    python -m backtester bench -- --scales 50 500
+
+Only argparse is imported up front: each command imports what it needs (pandas, the algo, the downloader...),
+so that --help and the light commands start fast. The time spent before the command starts its work is logged.
+"""
+import time
+
+START = time.perf_counter()
+
+import argparse
+import ast
+import logging
+
+logger = logging.getLogger("backtester")
+
+
+def parse_value(value:str):
+    """
+    Python literal if possible ("5", "0.004", "True", "[1, 2]"), the string itself otherwise.
+    """
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def parse_assignment(assignment:str) -> tuple:
+    name, separator, value = assignment.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {assignment}")
+    return name, value
+
+
+def report_startup(command:str):
+    logger.info(f"{command}: started in {(time.perf_counter() - START) * 1000:.0f}ms")
+
+
+def configure(args, algo_params=None):
+    """
+    BKTConfig of the command, with the --set values applied to it and/or to algo_params, wherever they are defined.
+    """
+    from backtester.config import BKTConfig
+
+    bkt_config = BKTConfig(data_dir=args.data_dir, results_dir=args.results_dir)
+    for name, value in args.set:
+        targets = [target for target in (bkt_config, algo_params) if target is not None and hasattr(target, name)]
+        if not targets:
+            raise SystemExit(f"Unknown parameter for {args.command}: {name}")
+        for target in targets:
+            setattr(target, name, parse_value(value))
+    return bkt_config
+
+
+def run_command(args):
+    from backtester.main import backtest, run_segments
+    from trading_algo.parameters import AlgoParameters
+
+    algo_params = AlgoParameters()
+    bkt_config = configure(args, algo_params)
+    bkt_config.profile = bkt_config.profile or args.profile
+    report_startup(args.command)
+
+    if args.segments:
+        print(run_segments(bkt_config, args.segments, workers=args.workers, algo_params=algo_params).to_string(index=False))
+    else:
+        algo = backtest(bkt_config, algo_params, resume=args.resume, show_progress=not args.no_progress)
+        print("\n".join(f"{name}: {value}" for name, value in algo.summary().items()))
+
+
+def sweep_command(args):
+    from backtester.sweep import sweep
+    from trading_algo.parameters import AlgoParameters
+
+    # the --set values are the base of every configuration of the grid
+    algo_params = AlgoParameters()
+    bkt_config = configure(args, algo_params)
+    grid = {name: [parse_value(value) for value in values.split(",")] for name, values in args.grid} or None
+    report_startup(args.command)
+
+    summary = sweep(bkt_config, grid, n_random=args.random, workers=args.workers, algo_params=algo_params)
+    print(summary.sort_values("pnl", ascending=False).to_string())
+
+
+def download_command(args):
+    from backtester.data.downloader import DataDownloader
+    from backtester.utils import update_data
+
+    bkt_config = configure(args)
+    report_startup(args.command)
+
+    if args.update:
+        update_data(bkt_config)
+    else:
+        DataDownloader(bkt_config).download_data()
+
+
+def convert_data_command(args):
+    from backtester.utils import convert_data
+
+    bkt_config = configure(args)
+    report_startup(args.command)
+    convert_data(bkt_config, args.to)
+
+
+def bench_command(args):
+    from benchmarks import run as benchmarks
+
+    report_startup(args.command)
+    # the arguments after "--" are those of benchmarks.run
+    bench_args = args.bench_args[1:] if args.bench_args[:1] == ["--"] else args.bench_args
+    benchmarks.main(bench_args)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m backtester", description="Simplified event-based backtester")
+    parser.add_argument("--data-dir", help="market data folder (default ./data)")
+    parser.add_argument("--results-dir", help="results folder (default ./results)")
+    parser.add_argument("--set", type=parse_assignment, action="append", default=[], metavar="NAME=VALUE",
+                        help="BKTConfig or AlgoParameters value, e.g. --set instruments_number=10 (repeatable)")
+    parser.add_argument("--log-level", default="INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the backtest and export its results")
+    run.add_argument("--resume", action="store_true", help="resume from the last checkpoint")
+    run.add_argument("--no-progress", action="store_true")
+    run.add_argument("--profile", action="store_true", help="time the stages of the algo (results_dir/profile.json)")
+    run.add_argument("--segments", type=int, help="split the backtest in segments run concurrently")
+    run.add_argument("--workers", type=int)
+    run.set_defaults(handler=run_command)
+
+    sweep = commands.add_parser("sweep", help="backtest a grid of parameters on a process pool")
+    sweep.add_argument("--grid", type=parse_assignment, action="append", default=[], metavar="NAME=V1,V2",
+                       help="values of a parameter (repeatable), the default grid of backtester.sweep otherwise")
+    sweep.add_argument("--random", type=int, help="run only this number of random combinations")
+    sweep.add_argument("--workers", type=int)
+    sweep.set_defaults(handler=sweep_command)
+
+    download = commands.add_parser("download", help="download the market data")
+    download.add_argument("--update", action="store_true", help="only fetch the new bars into the data store")
+    download.set_defaults(handler=download_command)
+
+    convert = commands.add_parser("convert-data", help="convert the csv files to the binary cache or to the data store")
+    convert.add_argument("--to", choices=["cache", "store"], default="cache")
+    convert.set_defaults(handler=convert_data_command)
+
+    bench = commands.add_parser("bench", help="offline benchmarks on synthetic data, see benchmarks/run.py")
+    bench.add_argument("bench_args", nargs=argparse.REMAINDER)
+    bench.set_defaults(handler=bench_command)
+    return parser
+
+
+def main(argv:list=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s - %(levelname)s - %(message)s")
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,60 @@
 import os
 
 class BKTConfig:
-    def __init__(self):
+    def __init__(self, data_dir:str=None, results_dir:str=None):
         # Data settings
-        self.data_dir = os.path.join(os.getcwd(), "data")
+        self.data_dir = data_dir or os.path.join(os.getcwd(), "data")
         self.sp500_tickers_file = os.path.join(self.data_dir, "sp500_tickers.txt")
         self.sp500_sectors_file = os.path.join(self.data_dir, "sp500_sectors.txt")
         self.daily_stocks_file = os.path.join(self.data_dir, "daily_stocks.csv")
         self.intraday_stocks_file = os.path.join(self.data_dir, "intraday_stocks.csv")
         self.daily_index_file = os.path.join(self.data_dir, "daily_index.csv")
         self.intraday_index_file = os.path.join(self.data_dir, "intraday_index.csv")
+
+        # Binary cache of the csv files, rebuilt when a csv changes
+        self.use_data_cache = True
+        self.data_cache_dir = os.path.join(self.data_dir, "cache")
+        self.data_cache_hash = False # also compare the content hash of the csv files (slower)
+
+        # Price storage: "memory" keeps the prices in process memory, "mmap" maps the binary cache 
+        # read-only so that the backtest processes running on the same host share the same pages, "window" reads the
+        # intraday stocks prices one session at a time (from the csv or the store) and keeps only intraday_window_days
+        # sessions in memory besides the rolling windows of the analyses, for histories that do not fit in memory
+        self.price_storage = "memory"
+        self.intraday_window_days = 2
+        self.price_dtype = "float64" # "float32" halves the size of the price matrices
+        
+        # Downloads: the tickers are fetched in chunks on a thread pool, each chunk is saved
+        # in download_chunks_dir as soon as it arrives so that an interrupted download resumes the missing ones
+        self.download_chunk_size = 50
+        self.download_workers = 4
+        self.download_retries = 3
+        self.download_backoff = 2.0 # seconds, doubled at each retry
+        self.download_chunks_dir = os.path.join(self.data_dir, "download_chunks")
+
+        # Date partitioned history of the data, extended by DataDownloader.update_data. With data_source = "store"
+        # the DataManager reads the partitions between data_start and data_end (None for no bound) instead of the csv files
+        self.data_store_dir = os.path.join(self.data_dir, "store")
+        self.data_source = "csv"
+        self.data_start = None
+        self.data_end = None
+
+        # Universe of the backtest (None disables a filter, the filters are combined): the intraday file is read only
+        # for the selected tickers. universe_sectors are matched against sp500_sectors_file, the price range against
+        # the last daily close and universe_min_coverage against the share of non empty daily prices
+        self.universe_tickers = None
+        self.universe_sectors = None
+        self.universe_min_price = None
+        self.universe_max_price = None
+        self.universe_min_coverage = None
         
+        # Outputs of the analyses saved per day (see TradingAlgo.analyse) and reused by the next runs on the same data
+        # and analysis parameters, e.g. when only the exits or the portfolio settings change. The least recently
+        # used days are evicted beyond feature_store_max_mb
+        self.feature_store = False
+        self.feature_store_dir = os.path.join(self.data_dir, "features")
+        self.feature_store_max_mb = 512
+
         # Backtest settings
         self.instruments_number = 5
         self.notional = 1_000_000
@@ -28,5 +72,14 @@ class BKTConfig:
         self.RESHUFFLE_FREQUENCY = 1
 
         # Output settings
-        self.results_dir = os.path.join(os.getcwd(), "results")
-        os.makedirs(self.results_dir, exist_ok=True)
+        # created when the first results are written, the config itself never touches the disk
+        self.results_dir = results_dir or os.path.join(os.getcwd(), "results")
+        self.results_format = "csv" # "parquet" needs pyarrow
+
+        # Time (and with profile_memory the peak memory of) each stage of the algo, report in results_dir/profile.json
+        self.profile = False
+        self.profile_memory = False
+
+        # Checkpoints of the algo state, written every checkpoint_every backtest days (0 disables them)
+        self.checkpoint_every = 0
+        self.checkpoint_file = os.path.join(self.results_dir, "checkpoint.pkl.gz")
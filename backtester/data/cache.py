@@ -0,0 +1,189 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .cube import IntradayCube
+
+
+class ColumnarCache:
+    """
+    Binary cache of the market data csv files.
+
+    Each csv is stored, once parsed and formatted, as raw .npy arrays in its own folder:
+    the datetime index, the column names and the prices matrix in column-major order, so that
+    a column can be read without touching the others. A cache entry is only used while the
+    size and the mtime (and optionally the content hash) of the source csv are unchanged.
+    """
+    VERSION = 1
+
+    def __init__(self, cache_dir:str, use_hash:bool=False):
+        self.cache_dir = cache_dir
+        self.use_hash = use_hash
+        self.logger = logging.getLogger(__name__)
+
+    def entry_dir(self, source_file:str) -> str:
+        name = os.path.splitext(os.path.basename(source_file))[0]
+        return os.path.join(self.cache_dir, name)
+
+    @staticmethod
+    def file_hash(source_file:str) -> str:
+        sha = hashlib.sha256()
+        with open(source_file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def fingerprint(self, source_file:str) -> dict:
+        stat = os.stat(source_file)
+        fingerprint = {"version": self.VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if self.use_hash:
+            fingerprint["sha256"] = self.file_hash(source_file)
+        return fingerprint
+
+    def is_valid(self, source_file:str) -> bool:
+        meta_file = os.path.join(self.entry_dir(source_file), "meta.json")
+        if not os.path.isfile(meta_file):
+            return False
+        with open(meta_file) as f:
+            meta = json.load(f)
+        return meta.get("fingerprint") == self.fingerprint(source_file)
+
+    def load(self, source_file:str, mmap:bool=False, dtype:str="float64", columns:list=None):
+        """
+        Returns the cached DataFrame of source_file, or None if there is no valid entry.
+        With mmap the prices are a read-only memory map of the cache file, shared by every process that maps it.
+        With columns only those columns (if present) are read: the matrix is column-major, so each of them is
+        a contiguous block of the file, and the result is an in-memory copy of the selection.
+        """
+        try:
+            return self.read_entry(source_file, mmap, dtype, columns)
+        except FileNotFoundError:
+            # replaced by another process while it was read
+            return None
+
+    def read_entry(self, source_file:str, mmap:bool, dtype:str, columns:list):
+        if not self.is_valid(source_file):
+            return None
+
+        entry = self.entry_dir(source_file)
+        with open(os.path.join(entry, "meta.json")) as f:
+            meta = json.load(f)
+
+        index = pd.DatetimeIndex(np.load(os.path.join(entry, "index.npy")), name=meta["index_name"])
+        if meta["tz"] is not None:
+            index = index.tz_localize("UTC").tz_convert(meta["tz"])
+        all_columns = np.load(os.path.join(entry, "columns.npy")).tolist()
+        if columns is None:
+            values = np.load(self.values_file(entry, dtype), mmap_mode="r" if mmap else None)
+            return pd.DataFrame(values, index=index, columns=all_columns, copy=False)
+
+        selected = set(columns)
+        positions = [pos for pos, column in enumerate(all_columns) if column in selected]
+        values = np.load(self.values_file(entry, dtype), mmap_mode="r")[:, positions]
+        return pd.DataFrame(values, index=index, columns=[all_columns[pos] for pos in positions], copy=False)
+
+    def values_file(self, entry:str, dtype:str) -> str:
+        """
+        Prices file of a cache entry. The float64 matrix is the reference, lower precision copies are written on first use.
+        """
+        values_file = os.path.join(entry, "values.npy")
+        if np.dtype(dtype) == np.float64:
+            return values_file
+
+        typed_values_file = os.path.join(entry, f"values.{np.dtype(dtype).name}.npy")
+        if not os.path.isfile(typed_values_file):
+            values = np.load(values_file, mmap_mode="r")
+            fd, tmp_file = tempfile.mkstemp(dir=entry, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.asfortranarray(values.astype(dtype)))
+            os.replace(tmp_file, typed_values_file)
+        return typed_values_file
+
+    def cube_dir(self, name:str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def load_cube(self, name:str, source_files:list, dtype:str="float64", mmap:bool=False):
+        """
+        Returns the cached IntradayCube built from source_files, or None if any of them changed.
+        """
+        meta_file = os.path.join(self.cube_dir(name), "meta.json")
+        if not os.path.isfile(meta_file):
+            return None
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta.get("sources") != [self.fingerprint(source_file) for source_file in source_files] or meta.get("dtype") != np.dtype(dtype).name:
+            return None
+        try:
+            return IntradayCube.load(self.cube_dir(name), mmap_mode="r" if mmap else None)
+        except FileNotFoundError:
+            return None
+
+    def temp_entry(self, entry:str) -> str:
+        # one temporary folder per writer, next to the entry: runs started together may all miss the cache and write it
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return tempfile.mkdtemp(dir=self.cache_dir, prefix=os.path.basename(entry) + ".tmp.")
+
+    def publish(self, tmp_entry:str, entry:str):
+        """
+        Replace entry with the folder tmp_entry. The previous entry is renamed aside before it is deleted, so that
+        a reader finds either a complete entry or none. If another process published the same entry in between,
+        its entry is kept and tmp_entry is dropped.
+        """
+        old_entry = tempfile.mkdtemp(dir=self.cache_dir, prefix=os.path.basename(entry) + ".old.")
+        try:
+            os.replace(entry, old_entry)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        shutil.rmtree(old_entry, ignore_errors=True)
+
+    def save_cube(self, name:str, source_files:list, cube:IntradayCube):
+        entry = self.cube_dir(name)
+        tmp_entry = self.temp_entry(entry)
+        cube.save(tmp_entry)
+        meta = {"sources": [self.fingerprint(source_file) for source_file in source_files], "dtype": cube.values.dtype.name}
+        with open(os.path.join(tmp_entry, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        self.publish(tmp_entry, entry)
+
+    def save(self, source_file:str, data:pd.DataFrame) -> bool:
+        """
+        Writes the formatted DataFrame of source_file to the cache. Frames that are not indexed by
+        datetimes or that hold non numeric columns are not cached.
+        """
+        if not isinstance(data.index, pd.DatetimeIndex):
+            self.logger.warning(f"{os.path.basename(source_file)} is not indexed by datetimes, it will not be cached")
+            return False
+        try:
+            values = np.asfortranarray(data.to_numpy(dtype=np.float64))
+        except (TypeError, ValueError):
+            self.logger.warning(f"{os.path.basename(source_file)} has non numeric columns, it will not be cached")
+            return False
+
+        index = data.index
+        tz = None
+        if index.tz is not None:
+            tz = str(index.tz)
+            index = index.tz_convert("UTC").tz_localize(None)
+
+        # Write to a temporary folder first so that an interrupted write never leaves a valid looking entry
+        entry = self.entry_dir(source_file)
+        tmp_entry = self.temp_entry(entry)
+
+        np.save(os.path.join(tmp_entry, "index.npy"), index.values.astype("datetime64[ns]"))
+        np.save(os.path.join(tmp_entry, "columns.npy"), np.array([str(column) for column in data.columns]))
+        np.save(os.path.join(tmp_entry, "values.npy"), values)
+        meta = {"fingerprint": self.fingerprint(source_file), "index_name": data.index.name, "tz": tz}
+        with open(os.path.join(tmp_entry, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        self.publish(tmp_entry, entry)
+        return True
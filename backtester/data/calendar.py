@@ -0,0 +1,69 @@
+from datetime import date as Date, datetime
+
+import numpy as np
+import pandas as pd
+
+
+def _days(index:pd.DatetimeIndex) -> np.ndarray:
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.normalize().values.astype("datetime64[D]")
+
+
+def shift_months(day:np.datetime64, months:int) -> np.datetime64:
+    """
+    day moved by months calendar months (same rules as pd.DateOffset).
+    """
+    return (pd.Timestamp(day) + pd.DateOffset(months=months)).to_datetime64().astype("datetime64[D]")
+
+
+def backtest_start(first_intraday_timestamp) -> pd.Timestamp:
+    """
+    First day of the backtest: 15 calendar days after the first intraday day, to fill the first intraday window.
+    """
+    return pd.Timestamp(first_intraday_timestamp).normalize() + pd.DateOffset(days=15)
+
+
+class TradingCalendar:
+    """
+    Integer offsets of every trading day (a day of the intraday data), computed once:
+
+    - day position: the position of the day in the intraday cubes (and in days)
+    - daily_stop: the daily rows up to and including the day are daily_stocks.iloc[:daily_stop[pos]]
+
+    so that the backtest loop only does positional slicing, without converting or parsing dates.
+    """
+    def __init__(self, daily_index:pd.DatetimeIndex, intraday_days:pd.DatetimeIndex) -> None:
+        self.days = _days(intraday_days)
+        self.dates = [day.date() for day in pd.DatetimeIndex(self.days)]
+        self.day_lookup = {day: pos for pos, day in enumerate(self.dates)}
+
+        self.daily_days = _days(daily_index)
+        self.daily_stop = np.searchsorted(self.daily_days, self.days, side="right")
+
+    def position(self, day) -> int:
+        """
+        Position of a day given as a date, a datetime, a numpy datetime64 or a "YYYY-MM-DD" string.
+        """
+        if isinstance(day, str):
+            day = datetime.strptime(day, "%Y-%m-%d").date()
+        elif isinstance(day, datetime):
+            day = day.date()
+        elif not isinstance(day, Date):
+            day = pd.Timestamp(day).date()
+        return self.day_lookup[day]
+
+    def positions(self, days) -> list:
+        return [self.position(day) for day in days]
+
+    def daily_start(self, start_day:np.datetime64) -> int:
+        """
+        First daily row on or after start_day.
+        """
+        return int(np.searchsorted(self.daily_days, start_day, side="left"))
+
+    def intraday_start(self, start_day:np.datetime64) -> int:
+        """
+        Position of the first trading day on or after start_day.
+        """
+        return int(np.searchsorted(self.days, start_day, side="left"))
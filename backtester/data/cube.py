@@ -0,0 +1,181 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class IntradayCube:
+    """
+    Dense intraday close prices aligned on a days x bars x tickers grid.
+
+    The cube is built once at load time so that the intraday consumers do not need to regroup the
+    long intraday frame by date every day. Bars are the union of the bar times found in the data,
+    a bar missing from a day is forward filled from the previous bar of the same day and flagged
+    as not valid in the mask.
+    """
+    def __init__(self, values:np.ndarray, mask:np.ndarray, days:pd.DatetimeIndex, bars:pd.TimedeltaIndex, tickers:list):
+        self.values = values
+        self.mask = mask
+        self.days = days
+        self.bars = bars
+        self.tickers = list(tickers)
+
+        # cube this one was resampled from, see resample
+        self.source = None
+
+        # Lookup tables
+        self.day_lookup = {day.date(): pos for pos, day in enumerate(days)}
+        self.ticker_lookup = {ticker: pos for pos, ticker in enumerate(self.tickers)}
+
+    @staticmethod
+    def axes(*frames:pd.DataFrame):
+        """
+        Union of the session days and of the bar times of the given intraday frames.
+        """
+        days = pd.DatetimeIndex([])
+        bars = pd.TimedeltaIndex([])
+        for frame in frames:
+            sessions = frame.index.normalize()
+            days = days.union(sessions.unique()) if len(days) else sessions.unique()
+            bars = bars.union((frame.index - sessions).unique())
+        return days.sort_values(), bars.sort_values()
+
+    @classmethod
+    def from_frame(cls, frame:pd.DataFrame, days:pd.DatetimeIndex=None, bars:pd.TimedeltaIndex=None, dtype=np.float64) -> 'IntradayCube':
+        if days is None or bars is None:
+            days, bars = cls.axes(frame)
+
+        sessions = frame.index.normalize()
+        day_pos = days.get_indexer(sessions)
+        bar_pos = bars.get_indexer(frame.index - sessions)
+        in_grid = (day_pos >= 0) & (bar_pos >= 0)
+
+        values = np.full((len(days), len(bars), frame.shape[1]), np.nan, dtype=dtype)
+        values[day_pos[in_grid], bar_pos[in_grid]] = frame.to_numpy(dtype=dtype)[in_grid]
+        mask = ~np.isnan(values)
+
+        present = np.zeros((len(days), len(bars)), dtype=bool)
+        present[day_pos[in_grid], bar_pos[in_grid]] = True
+        for bar in range(1, len(bars)):
+            absent = ~present[:, bar]
+            values[absent, bar] = values[absent, bar - 1]
+
+        return cls(values, mask, days, bars, frame.columns)
+
+    @staticmethod
+    def bar_size(bars:pd.TimedeltaIndex) -> float:
+        """
+        Bar size in minutes (the smallest gap between two bars), None with less than two bars.
+        """
+        if len(bars) < 2:
+            return None
+        return float(np.diff(bars.values).min() / np.timedelta64(1, "m"))
+
+    def bar_minutes(self) -> float:
+        return self.bar_size(self.bars)
+
+    @staticmethod
+    def resampled_bars(bars:pd.TimedeltaIndex, minutes:int):
+        """
+        Bars of minutes length covering bars, labelled by their start, with the position of the first and of the last bar
+        of bars in each of them.
+        """
+        groups = np.asarray(bars // pd.Timedelta(minutes=minutes), dtype=np.int64)
+        groups, first = np.unique(groups, return_index=True)
+        last = np.append(first[1:], len(bars)) - 1
+        return pd.to_timedelta(groups * minutes, unit="min"), first, last
+
+    def resample(self, minutes:int) -> 'IntradayCube':
+        """
+        Cube of the close prices on minutes bars: the close of a bar is the last valid price of the bars of the day that
+        fall in it, labelled by its start as the downloaded bars are. A bar is valid for a ticker if one of its bars is.
+        """
+        bar_minutes = self.bar_minutes()
+        if bar_minutes is not None and minutes < bar_minutes:
+            raise ValueError(f"Cannot resample {bar_minutes:g} minutes bars to {minutes} minutes")
+        bars, first, last = self.resampled_bars(self.bars, minutes)
+
+        values = self.values[:, last]
+        # the absent bars are already forward filled, a ticker can still be empty on the last bars of a group
+        for offset in range(1, int((last - first).max(initial=0)) + 1):
+            previous = np.maximum(last - offset, first)
+            empty = np.isnan(values)
+            values[empty] = self.values[:, previous][empty]
+        mask = np.logical_or.reduceat(self.mask, first, axis=1) if len(first) else self.mask[:, :0]
+
+        cube = IntradayCube(values, mask, self.days, bars, self.tickers)
+        cube.source = self
+        return cube
+
+    def save(self, path:str):
+        os.makedirs(path, exist_ok=True)
+        days = self.days
+        tz = None
+        if days.tz is not None:
+            tz = str(days.tz)
+            days = days.tz_convert("UTC").tz_localize(None)
+
+        np.save(os.path.join(path, "values.npy"), self.values)
+        np.save(os.path.join(path, "mask.npy"), self.mask)
+        np.save(os.path.join(path, "days.npy"), days.values.astype("datetime64[ns]"))
+        np.save(os.path.join(path, "bars.npy"), self.bars.values.astype("timedelta64[ns]"))
+        np.save(os.path.join(path, "tickers.npy"), np.array([str(ticker) for ticker in self.tickers]))
+        with open(os.path.join(path, "cube.json"), "w") as f:
+            json.dump({"tz": tz}, f)
+
+    @classmethod
+    def load(cls, path:str, mmap_mode:str=None) -> 'IntradayCube':
+        """
+        Load a saved cube. With mmap_mode="r" values and mask stay on disk and are shared between processes.
+        """
+        with open(os.path.join(path, "cube.json")) as f:
+            tz = json.load(f)["tz"]
+        days = pd.DatetimeIndex(np.load(os.path.join(path, "days.npy")))
+        if tz is not None:
+            days = days.tz_localize("UTC").tz_convert(tz)
+
+        return cls(np.load(os.path.join(path, "values.npy"), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, "mask.npy"), mmap_mode=mmap_mode),
+                   days,
+                   pd.TimedeltaIndex(np.load(os.path.join(path, "bars.npy"))),
+                   np.load(os.path.join(path, "tickers.npy")).tolist())
+
+    def fingerprint_arrays(self) -> list:
+        """
+        Arrays that identify the content of the cube, hashed by the feature store.
+        """
+        if self.source is not None:
+            return self.source.fingerprint_arrays()
+        return [self.values, self.tickers]
+
+    def session_slice(self, session_start:str, session_end:str) -> slice:
+        """
+        Bars between session_start and session_end (both included), e.g. "09:35:00" and "15:45:00".
+        """
+        start = self.bars.searchsorted(pd.Timedelta(session_start), side="left")
+        end = self.bars.searchsorted(pd.Timedelta(session_end), side="right")
+        return slice(start, end)
+
+    def columns(self, tickers) -> list:
+        return [self.ticker_lookup[ticker] for ticker in tickers]
+
+    def timestamps(self, day_pos:int, bars:slice=slice(None)) -> pd.DatetimeIndex:
+        return self.days[day_pos] + self.bars[bars]
+
+    def returns(self, day_pos:int, bars:slice=slice(None)):
+        """
+        Cumulative and pct returns of a day over the given bars, both with shape bars x tickers.
+        Pct returns of bars that are missing for every ticker are NaN so that they can be skipped
+        by the nan-aware reductions.
+        """
+        prices = self.values[day_pos, bars]
+        pct_change = np.zeros_like(prices)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct_change[1:] = prices[1:] / prices[:-1] - 1
+        pct_change[np.isnan(pct_change)] = 0
+        cum_ret = np.cumprod(1 + pct_change, axis=0)
+
+        absent = ~self.mask[day_pos, bars].any(axis=1)
+        pct_change[absent] = np.nan
+        return cum_ret, pct_change
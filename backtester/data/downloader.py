@@ -1,50 +1,186 @@
-import yfinance as yf
-import pandas as pd
-from datetime import datetime, timedelta
+import hashlib
 import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import pandas as pd
 from ..config import BKTConfig
+from .store import EXCHANGE_TZ, PartitionedStore
+
+
+class YFinanceProvider:
+    """
+    Close prices from Yahoo Finance. yfinance is imported on the first download only.
+    """
+    def fetch(self, tickers:list, start:datetime, end:datetime, interval:str) -> pd.DataFrame:
+        import yfinance as yf
+
+        data = yf.download(tickers, start=start, end=end, interval=interval, progress=False, threads=False)["Close"]
+        if isinstance(data, pd.Series):
+            data = data.to_frame(tickers[0])
+        return data
 
 
 class DataDownloader:
-    def __init__(self, bkt_config:BKTConfig):
-        self.sp500_tickers = self.get_sp500_tickers()
-        self.index_ticker = "^GSPC"
+    """
+    Downloads the daily and the 2 minute intraday close prices of the S&P 500 stocks and of the index.
+
+    The tickers are split in chunks of download_chunk_size fetched concurrently by download_workers threads,
+    each chunk is retried download_retries times with an exponential backoff. Every chunk is written to
+    download_chunks_dir as soon as it arrives: a run interrupted before the data is saved resumes the same day
+    with only the chunks that are missing, the chunks of a finished run are deleted. The provider is anything with a fetch(tickers, start, end, interval) method
+    returning the close prices (one column per ticker), YFinanceProvider by default.
+    """
+    def __init__(self, bkt_config:BKTConfig, provider=None, tickers:list=None):
         self.bkt_config = bkt_config
+        self.provider = provider if provider is not None else YFinanceProvider()
+        self.sp500_tickers = tickers
+        self.index_ticker = "^GSPC"
         self.data_path = self.bkt_config.data_dir
 
         # Initialize logging
         logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
         self.logger = logging.getLogger(__name__)
-    
+
     def get_sp500_tickers(self):
         """
-        Retrieves S&P 500 tickers from Wikipedia.
+        Retrieves S&P 500 tickers from Wikipedia, their GICS sectors are saved to sp500_sectors_file.
         """
         url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-        tickers = pd.read_html(url)[0]["Symbol"].tolist()
-        
+        companies = pd.read_html(url)[0]
+
         # Handle tickers with special characters
-        tickers = [ticker.replace(".", "-") for ticker in tickers]
+        tickers = [ticker.replace(".", "-") for ticker in companies["Symbol"]]
+
+        os.makedirs(self.data_path, exist_ok=True)
+        pd.DataFrame({"ticker": tickers, "sector": companies["GICS Sector"].values}).to_csv(self.bkt_config.sp500_sectors_file, index=False)
         return tickers
-    
+
+    def tickers(self) -> list:
+        if self.sp500_tickers is None:
+            self.sp500_tickers = self.get_sp500_tickers()
+        return self.sp500_tickers
+
+    def chunk_file(self, chunks_dir:str, chunk:list) -> str:
+        # the name depends on the tickers of the chunk, so that a different tickers list does not reuse it
+        chunk_hash = hashlib.sha1(",".join(chunk).encode()).hexdigest()[:12]
+        return os.path.join(chunks_dir, f"{chunk[0]}_{len(chunk)}_{chunk_hash}.csv")
+
+    def fetch_chunk(self, chunk:list, start:datetime, end:datetime, interval:str, chunk_file:str) -> int:
+        """
+        Fetch a chunk with retries and write it to chunk_file. Returns the number of retries needed.
+        """
+        retries = self.bkt_config.download_retries
+        for attempt in range(retries + 1):
+            try:
+                data = self.provider.fetch(chunk, start, end, interval)
+                if data is None or data.empty:
+                    raise ValueError(f"no data for {chunk[0]}... ({len(chunk)} tickers)")
+                break
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                delay = self.bkt_config.download_backoff * 2 ** attempt
+                self.logger.warning(f"Chunk {chunk[0]}... failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+        temp_file = chunk_file + ".tmp"
+        data.to_csv(temp_file)
+        os.replace(temp_file, chunk_file)
+        return attempt
+
+    def chunks_dir(self, name:str, start:datetime, end:datetime, interval:str) -> str:
+        return os.path.join(self.bkt_config.download_chunks_dir, f"{name}_{interval}_{start:%Y%m%d}_{end:%Y%m%d}")
+
+    def clear_chunks(self, name:str, start:datetime, end:datetime, interval:str):
+        """
+        Delete the chunks of a download once its data is saved: the chunks are only kept to resume an interrupted run,
+        a later run on the same day must fetch the data again.
+        """
+        shutil.rmtree(self.chunks_dir(name, start, end, interval), ignore_errors=True)
+
+    @staticmethod
+    def read_chunk(chunk_file:str) -> pd.DataFrame:
+        """
+        Prices of a chunk file. The intraday timestamps of yfinance carry their UTC offset, which changes with daylight
+        saving time: they are parsed in UTC and converted to the exchange timezone. Timestamps without offset are kept as they are.
+        """
+        data = pd.read_csv(chunk_file, index_col=0)
+        index = data.index.astype(str)
+        if index.str.contains(r"[+-]\d{2}:\d{2}$").any():
+            data.index = pd.to_datetime(index, utc=True).tz_convert(EXCHANGE_TZ)
+        else:
+            data.index = pd.to_datetime(index)
+        return data
+
+    def download_frame(self, name:str, tickers:list, start:datetime, end:datetime, interval:str) -> tuple:
+        """
+        Download the close prices of tickers in chunks and merge them. Returns the prices and the download report.
+        The chunks are kept until the caller saves the data and calls clear_chunks.
+        """
+        chunks_dir = self.chunks_dir(name, start, end, interval)
+        os.makedirs(chunks_dir, exist_ok=True)
+
+        chunk_size = self.bkt_config.download_chunk_size
+        chunks = [tickers[i : i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+        chunk_files = [self.chunk_file(chunks_dir, chunk) for chunk in chunks]
+        missing = [(chunk, file) for chunk, file in zip(chunks, chunk_files) if not os.path.isfile(file)]
+
+        report = {"name": name, "chunks": len(chunks), "resumed": len(chunks) - len(missing), "downloaded": 0, "failed": 0, "retries": 0}
+        failed_tickers = []
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.bkt_config.download_workers) as executor:
+            futures = {executor.submit(self.fetch_chunk, chunk, start, end, interval, file): chunk for chunk, file in missing}
+            for future in as_completed(futures):
+                try:
+                    report["retries"] += future.result()
+                    report["downloaded"] += 1
+                except Exception as e:
+                    report["failed"] += 1
+                    failed_tickers += futures[future]
+                    self.logger.error(f"Chunk {futures[future][0]}... failed: {e}")
+
+        elapsed = time.perf_counter() - start_time
+        report["seconds"] = elapsed
+        report["chunks_per_second"] = report["downloaded"] / elapsed if elapsed > 0 else 0.0
+        self.logger.info(f"{name}: {report['downloaded']} chunks downloaded, {report['resumed']} resumed, {report['failed']} failed, "
+                         f"{report['retries']} retries in {elapsed:.1f}s ({report['chunks_per_second']:.2f} chunks/s)")
+
+        if failed_tickers:
+            raise RuntimeError(f"{name}: {report['failed']} chunks failed ({len(failed_tickers)} tickers), run the download again to resume")
+
+        data = pd.concat([self.read_chunk(file) for file in chunk_files], axis=1).sort_index()
+        data.index.name = "Date" if interval == "1d" else "Datetime"
+        return data, report
+
+    def download(self, name:str, tickers:list, start:datetime, end:datetime, interval:str, output_file:str) -> dict:
+        """
+        Download the close prices of tickers and write them to output_file. Returns the download report.
+        """
+        data, report = self.download_frame(name, tickers, start, end, interval)
+        data.to_csv(output_file)
+        self.clear_chunks(name, start, end, interval)
+        return report
+
     def download_daily_data(self):
         """
         Downloads daily data for the S&P 500 stocks and index for the last 6 months.
         """
         end_date = datetime.now()
         start_date = end_date - timedelta(days=self.bkt_config.daily_data_days)  # Approximately 6 months
-        
+
         self.logger.debug(f"Downloading daily data from {start_date.date()} to {end_date.date()}...")
-        
-        # Download data
-        stocks_data = yf.download(self.sp500_tickers, start=start_date, end=end_date, interval="1d")["Close"]
-        index_data = yf.download(self.index_ticker, start=start_date, end=end_date, interval="1d")["Close"]
-        
-        # Save to CSV
-        stocks_data.to_csv(self.bkt_config.daily_stocks_file)
-        index_data.to_csv(self.bkt_config.daily_index_file)
-        
+
+        reports = [
+            self.download("daily_stocks", self.tickers(), start_date, end_date, "1d", self.bkt_config.daily_stocks_file),
+            self.download("daily_index", [self.index_ticker], start_date, end_date, "1d", self.bkt_config.daily_index_file),
+        ]
+
         self.logger.debug("Daily data downloaded and saved.")
+        return reports
 
     def download_intraday_data(self):
         """
@@ -52,22 +188,61 @@ class DataDownloader:
         """
         end_date = datetime.now()
         start_date = end_date - timedelta(days=self.bkt_config.intraday_data_days)
-        
+
         self.logger.debug(f"Downloading intraday 2-minute data from {start_date.date()} to {end_date.date()}...")
-        
-        # Download data
-        stocks_data = yf.download(self.sp500_tickers, start=start_date, end=end_date, interval="2m")["Close"]
-        index_data = yf.download(self.index_ticker, start=start_date, end=end_date, interval="2m")["Close"]
-        
-        # Save to CSV
-        stocks_data.to_csv(self.bkt_config.intraday_stocks_file)
-        index_data.to_csv(self.bkt_config.intraday_index_file)
-        
+
+        reports = [
+            self.download("intraday_stocks", self.tickers(), start_date, end_date, "2m", self.bkt_config.intraday_stocks_file),
+            self.download("intraday_index", [self.index_ticker], start_date, end_date, "2m", self.bkt_config.intraday_index_file),
+        ]
+
         self.logger.debug("Intraday data downloaded and saved.")
+        return reports
+
+    def datasets(self) -> list:
+        """
+        (name, tickers, interval, days available at the source, csv file) of each dataset.
+        """
+        return [
+            ("daily_stocks", self.tickers(), "1d", self.bkt_config.daily_data_days, self.bkt_config.daily_stocks_file),
+            ("daily_index", [self.index_ticker], "1d", self.bkt_config.daily_data_days, self.bkt_config.daily_index_file),
+            ("intraday_stocks", self.tickers(), "2m", self.bkt_config.intraday_data_days, self.bkt_config.intraday_stocks_file),
+            ("intraday_index", [self.index_ticker], "2m", self.bkt_config.intraday_data_days, self.bkt_config.intraday_index_file),
+        ]
+
+    def update_data(self, store:PartitionedStore=None, export:bool=True) -> list:
+        """
+        Fetch only the bars newer than the last one in the partitioned store (from the start of its day, which
+        may still be incomplete) and append them. Datasets not in the store yet are downloaded over the days
+        available at the source. With export the csv files read by the DataManager are rewritten from the store,
+        between data_start and data_end.
+        """
+        store = store if store is not None else PartitionedStore(self.bkt_config.data_store_dir)
+        end_date = datetime.now()
+
+        reports = []
+        for name, tickers, interval, days, csv_file in self.datasets():
+            source_start = end_date - timedelta(days=days)
+            last_timestamp = store.last_timestamp(name)
+            if last_timestamp is None:
+                start_date = source_start
+            else:
+                start_date = max(last_timestamp.to_pydatetime().replace(hour=0, minute=0, second=0, microsecond=0), source_start)
+                if start_date > last_timestamp:
+                    self.logger.warning(f"{name}: the data between {last_timestamp} and {start_date.date()} is no longer available at the source")
+
+            data, report = self.download_frame(name, tickers, start_date, end_date, interval)
+            report["partitions"] = store.append(name, data, partition="month" if interval == "1d" else "day")
+            self.clear_chunks(name, start_date, end_date, interval)
+            self.logger.info(f"{name}: {len(report['partitions'])} partitions updated from {start_date.date()}")
+            reports.append(report)
+
+            if export:
+                store.export(name, csv_file, self.bkt_config.data_start, self.bkt_config.data_end)
+        return reports
 
     def download_data(self):
         """
         Executes the downloading process for both daily and intraday data.
         """
-        self.download_daily_data()
-        self.download_intraday_data()
+        return self.download_daily_data() + self.download_intraday_data()
@@ -1,12 +1,39 @@
+import hashlib
+import logging
+import os
+import time
+
 import pandas as pd
 from ..config import BKTConfig
+from .cache import ColumnarCache
+from .calendar import backtest_start
+from .cube import IntradayCube
+from .store import PARTITION_FORMATS, PartitionedStore
+from .universe import UniverseSelector
+from .window import CsvSessionReader, StoreSessionReader, WindowedIntradayCube
 
 class MarketData: 
-    def __init__(self, daily_stocks:pd.DataFrame, intraday_stocks:pd.DataFrame, daily_index:pd.DataFrame, intraday_index:pd.DataFrame):
+    def __init__(self, daily_stocks:pd.DataFrame, intraday_stocks:pd.DataFrame, daily_index:pd.DataFrame, intraday_index:pd.DataFrame,
+                 intraday_cube:IntradayCube, intraday_index_cube:IntradayCube):
         self.daily_stocks = daily_stocks
         self.intraday_stocks = intraday_stocks
         self.daily_index = daily_index
         self.intraday_index = intraday_index
+        self.intraday_cube = intraday_cube
+        self.intraday_index_cube = intraday_index_cube
+        # resampled stocks and index cubes by bar size in minutes, see resampled_cubes
+        self.resampled = {}
+
+    def resampled_cubes(self, minutes:int=None) -> tuple:
+        """
+        Stocks and index cubes on minutes bars (None for the bars of the data). Each resolution is resampled once
+        and shared by every algo running on this market data.
+        """
+        if minutes is None or minutes == self.intraday_cube.bar_minutes():
+            return self.intraday_cube, self.intraday_index_cube
+        if minutes not in self.resampled:
+            self.resampled[minutes] = (self.intraday_cube.resample(minutes), self.intraday_index_cube.resample(minutes))
+        return self.resampled[minutes]
 
 class DataManager:
     def __init__(self, config:BKTConfig):
@@ -15,35 +42,145 @@ class DataManager:
         self.intraday_stocks = pd.DataFrame()
         self.daily_index = pd.DataFrame()
         self.intraday_index = pd.DataFrame()
+        self.intraday_cube = None
+        self.intraday_index_cube = None
+        self.universe = None # selected tickers, None for every ticker of the files
+
+        self.store = PartitionedStore(self.config.data_store_dir)
+        self.cache = ColumnarCache(self.config.data_cache_dir, use_hash=self.config.data_cache_hash)
+        # the memory mapped storage is backed by the binary cache files
+        self.mmap = self.config.price_storage == "mmap"
+        # out-of-core intraday stocks prices, read by session by the cube
+        self.windowed = self.config.price_storage == "window"
+        self.session_reader = None
+        self.use_cache = self.config.use_data_cache or self.mmap
+        self.logger = logging.getLogger(__name__)
 
     def load_data(self):
         """
         Load and return the datasets for S&P500 stocks and indices.
         """
+        start = time.perf_counter()
         try:
-            self.daily_stocks = pd.read_csv(self.config.daily_stocks_file, sep=",")
-            self.intraday_stocks = pd.read_csv(self.config.intraday_stocks_file, sep=",")
-            self.daily_index = pd.read_csv(self.config.daily_index_file, sep=",")
-            self.intraday_index = pd.read_csv(self.config.intraday_index_file, sep=",")
+            self.daily_stocks = self.read_market_file(self.config.daily_stocks_file)
+            selector = UniverseSelector(self.config)
+            if selector.is_restricted:
+                # the selection only needs the daily prices, the intraday file is then read for the selected tickers only
+                self.universe = selector.select(self.format_frame(self.daily_stocks), backtest_start(self.first_intraday_timestamp()))
+                self.daily_stocks = self.daily_stocks[self.universe]
+            if self.windowed:
+                self.intraday_stocks = self.index_sessions(self.config.intraday_stocks_file)
+            else:
+                self.intraday_stocks = self.read_market_file(self.config.intraday_stocks_file, self.universe)
+            self.daily_index = self.read_market_file(self.config.daily_index_file)
+            self.intraday_index = self.read_market_file(self.config.intraday_index_file)
 
             
         except FileNotFoundError as e:
             raise Exception(f"Data file not found: {e}")
+
+        self.logger.info(f"Market data loaded in {time.perf_counter() - start:.3f}s")
+
+    def first_intraday_timestamp(self) -> pd.Timestamp:
+        """
+        First timestamp of the intraday stocks data, read without loading the file.
+        """
+        if self.config.data_source == "store":
+            dataset = os.path.splitext(os.path.basename(self.config.intraday_stocks_file))[0]
+            start = self.config.data_start
+            start_key = pd.Timestamp(start).strftime(PARTITION_FORMATS[self.store.partition(dataset) or "day"]) if start is not None else None
+            for key, file in self.store.partitions(dataset):
+                if start_key is not None and key < start_key:
+                    continue
+                data = self.store.in_range(PartitionedStore.read_partition(file), self.config.data_start, self.config.data_end)
+                if not data.empty:
+                    return data.index.min()
+            raise FileNotFoundError(f"No data for {dataset} in {self.store.store_dir}")
+        return pd.Timestamp(pd.to_datetime(pd.read_csv(self.config.intraday_stocks_file, usecols=[0], nrows=1).iloc[0, 0]))
+
+    def read_market_file(self, source_file:str, columns:list=None) -> pd.DataFrame:
+        """
+        Read a market data csv, from its binary cache when it is up to date. 
+        On a cache miss the csv is parsed, formatted and written to the cache for the next runs.
+        With columns only those tickers are read. The cache always holds the whole file, so a cache miss
+        parses every column once, the later runs read the selected columns only.
+        """
+        file_name = os.path.basename(source_file)
+        start = time.perf_counter()
+
+        if self.config.data_source == "store":
+            dataset = os.path.splitext(file_name)[0]
+            data = self.store.read(dataset, self.config.data_start, self.config.data_end, columns)
+            self.logger.info(f"{dataset}: read from the store in {time.perf_counter() - start:.3f}s")
+            return data.astype(self.config.price_dtype)
+
+        if self.use_cache:
+            data = self.cache.load(source_file, mmap=self.mmap, dtype=self.config.price_dtype, columns=columns)
+            if data is not None:
+                self.logger.info(f"{file_name}: loaded from cache in {time.perf_counter() - start:.3f}s")
+                return data
+
+        usecols = None
+        if columns is not None and not self.use_cache:
+            # the first column is the index
+            header = pd.read_csv(source_file, nrows=0).columns
+            selected = set(columns)
+            usecols = [header[0]] + [column for column in header[1:] if column in selected]
+        data = self.format_frame(pd.read_csv(source_file, sep=",", usecols=usecols))
+        self.logger.info(f"{file_name}: parsed from csv in {time.perf_counter() - start:.3f}s")
+
+        if self.use_cache:
+            write_start = time.perf_counter()
+            if self.cache.save(source_file, data):
+                self.logger.info(f"{file_name}: cache written in {time.perf_counter() - write_start:.3f}s")
+                if self.mmap or columns is not None:
+                    # drop the parsed copy and map (or read the selected columns of) the file that has just been written
+                    cached = self.cache.load(source_file, mmap=self.mmap, dtype=self.config.price_dtype, columns=columns)
+                    if cached is not None:
+                        return cached
+                    # the entry was replaced by another run in between (or the csv changed), keep the parsed frame
+                    if columns is not None:
+                        selected = set(columns)
+                        data = data[[column for column in data.columns if column in selected]]
+
+        return data.astype(self.config.price_dtype) if data.dtypes.ne(self.config.price_dtype).any() else data
+
+    def index_sessions(self, source_file:str) -> pd.DataFrame:
+        """
+        Session reader of an intraday file, the frame returned only has its timestamps (no prices) as index.
+        """
+        start = time.perf_counter()
+        if self.config.data_source == "store":
+            dataset = os.path.splitext(os.path.basename(source_file))[0]
+            self.session_reader = StoreSessionReader(self.store, dataset, self.config.data_start, self.config.data_end)
+        else:
+            if not os.path.isfile(source_file):
+                raise FileNotFoundError(source_file)
+            name = os.path.splitext(os.path.basename(source_file))[0]
+            self.session_reader = CsvSessionReader(source_file, os.path.join(self.config.data_cache_dir, f"{name}_sessions.npz"),
+                                                   self.cache.fingerprint(source_file))
+        self.logger.info(f"{os.path.basename(source_file)}: {len(self.session_reader.sessions)} sessions indexed in {time.perf_counter() - start:.3f}s")
+        return pd.DataFrame(index=self.session_reader.timestamps)
+
+    @staticmethod
+    def format_frame(data:pd.DataFrame) -> pd.DataFrame:
+        """
+        Use the first column (Datetime) as index. Frames that are already indexed by datetimes are left as they are.
+        """
+        if isinstance(data.index, pd.DatetimeIndex):
+            return data
+        data[data.columns[0]] = pd.to_datetime(data[data.columns[0]])
+        data.set_index(data.columns[0], inplace=True, drop=True)
+        return data
         
     def format_data(self):
         """
         Format mrket_data so that the index column is Datetime.
         """
-        
-        self.daily_stocks[self.daily_stocks.columns[0]] = pd.to_datetime(self.daily_stocks[self.daily_stocks.columns[0]])
-        self.daily_index[self.daily_index.columns[0]] = pd.to_datetime(self.daily_index[self.daily_index.columns[0]])
-        self.intraday_stocks[self.intraday_stocks.columns[0]] = pd.to_datetime(self.intraday_stocks[self.intraday_stocks.columns[0]])
-        self.intraday_index[self.intraday_index.columns[0]] = pd.to_datetime(self.intraday_index[self.intraday_index.columns[0]])
-        
-        self.daily_stocks.set_index(self.daily_stocks.columns[0], inplace=True, drop=True)
-        self.daily_index.set_index(self.daily_index.columns[0], inplace=True, drop=True)
-        self.intraday_stocks.set_index(self.intraday_stocks.columns[0], inplace=True, drop=True)
-        self.intraday_index.set_index(self.intraday_index.columns[0], inplace=True, drop=True)
+        self.daily_stocks = self.format_frame(self.daily_stocks)
+        self.daily_index = self.format_frame(self.daily_index)
+        self.intraday_stocks = self.format_frame(self.intraday_stocks)
+        self.intraday_index = self.format_frame(self.intraday_index)
 
     def clean_data(self): 
         """
@@ -55,5 +192,43 @@ class DataManager:
         self.intraday_index.ffill()
         
 
+    def build_intraday_cubes(self):
+        """
+        Align stocks and index intraday data on the same days x bars grid.
+        With the memory mapped storage the cubes are built once, saved next to the binary cache and mapped read-only.
+        """
+        dtype = self.config.price_dtype
+        source_files = [self.config.intraday_stocks_file, self.config.intraday_index_file]
+        cube_name = f"intraday_cube_{dtype}"
+        if self.universe is not None:
+            cube_name += "_" + hashlib.sha1(",".join(self.intraday_stocks.columns).encode()).hexdigest()[:12]
+        if self.mmap:
+            self.intraday_cube = self.cache.load_cube(cube_name, source_files, dtype, mmap=True)
+            self.intraday_index_cube = self.cache.load_cube(f"intraday_index_cube_{dtype}", source_files, dtype, mmap=True)
+            if self.intraday_cube is not None and self.intraday_index_cube is not None:
+                return
+
+        days, bars = IntradayCube.axes(self.intraday_stocks, self.intraday_index)
+        if self.windowed:
+            selected = set(self.universe) if self.universe is not None else None
+            tickers = [ticker for ticker in self.session_reader.header[1:] if selected is None or ticker in selected]
+            self.intraday_cube = WindowedIntradayCube(self.session_reader, days, bars, tickers, dtype, self.config.intraday_window_days)
+            self.intraday_index_cube = IntradayCube.from_frame(self.intraday_index, days, bars, dtype)
+            return
+
+        self.intraday_cube = IntradayCube.from_frame(self.intraday_stocks, days, bars, dtype)
+        self.intraday_index_cube = IntradayCube.from_frame(self.intraday_index, days, bars, dtype)
+
+        if self.mmap:
+            self.cache.save_cube(cube_name, source_files, self.intraday_cube)
+            self.cache.save_cube(f"intraday_index_cube_{dtype}", source_files, self.intraday_index_cube)
+            # the cubes that have just been built are kept if the saved ones cannot be mapped (replaced by another run in between)
+            intraday_cube = self.cache.load_cube(cube_name, source_files, dtype, mmap=True)
+            intraday_index_cube = self.cache.load_cube(f"intraday_index_cube_{dtype}", source_files, dtype, mmap=True)
+            if intraday_cube is not None and intraday_index_cube is not None:
+                self.intraday_cube, self.intraday_index_cube = intraday_cube, intraday_index_cube
+
     def return_data(self) -> MarketData: 
-        return MarketData(self.daily_stocks, self.intraday_stocks, self.daily_index, self.intraday_index)
+        if self.intraday_cube is None:
+            self.build_intraday_cubes()
+        return MarketData(self.daily_stocks, self.intraday_stocks, self.daily_index, self.intraday_index, self.intraday_cube, self.intraday_index_cube)
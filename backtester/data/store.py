@@ -0,0 +1,127 @@
+import glob
+import json
+import os
+
+import pandas as pd
+
+EXCHANGE_TZ = "America/New_York"
+
+# partition key formats
+PARTITION_FORMATS = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+
+
+class PartitionedStore:
+    """
+    Local history of the market data, one folder per dataset and one csv file per day (or month) of data:
+
+        <store_dir>/<dataset>/meta.json
+        <store_dir>/<dataset>/<YYYY-MM-DD>.csv
+
+    Appending new bars only writes the partitions they fall in, so the history older than the last partition
+    is never rewritten and is kept after it expires at the source. The timestamps are stored as exchange local
+    times without timezone, as the rest of the backtester expects.
+    """
+    def __init__(self, store_dir:str) -> None:
+        self.store_dir = store_dir
+
+    def dataset_dir(self, dataset:str) -> str:
+        return os.path.join(self.store_dir, dataset)
+
+    def partition(self, dataset:str) -> str:
+        meta_file = os.path.join(self.dataset_dir(dataset), "meta.json")
+        if not os.path.isfile(meta_file):
+            return None
+        with open(meta_file) as f:
+            return json.load(f)["partition"]
+
+    def partitions(self, dataset:str) -> list:
+        """
+        Sorted (key, file) of the partitions of dataset.
+        """
+        files = glob.glob(os.path.join(self.dataset_dir(dataset), "*.csv"))
+        return sorted((os.path.splitext(os.path.basename(file))[0], file) for file in files)
+
+    @staticmethod
+    def read_partition(file:str, columns:list=None) -> pd.DataFrame:
+        usecols = None
+        if columns is not None:
+            # the first column is the index
+            header = pd.read_csv(file, nrows=0).columns
+            selected = set(columns)
+            usecols = [header[0]] + [column for column in header[1:] if column in selected]
+        data = pd.read_csv(file, index_col=0, usecols=usecols)
+        data.index = pd.to_datetime(data.index)
+        return data
+
+    @staticmethod
+    def local_times(data:pd.DataFrame) -> pd.DataFrame:
+        if isinstance(data.index, pd.DatetimeIndex) and data.index.tz is not None:
+            data = data.copy()
+            data.index = data.index.tz_convert(EXCHANGE_TZ).tz_localize(None)
+        return data
+
+    def last_timestamp(self, dataset:str) -> pd.Timestamp:
+        partitions = self.partitions(dataset)
+        if not partitions:
+            return None
+        return self.read_partition(partitions[-1][1]).index.max()
+
+    def append(self, dataset:str, data:pd.DataFrame, partition:str="day") -> list:
+        """
+        Merge data into the partitions it covers, the new values replace the stored ones on the same timestamps.
+        Returns the keys of the partitions written.
+        """
+        dataset_dir = self.dataset_dir(dataset)
+        os.makedirs(dataset_dir, exist_ok=True)
+        partition = self.partition(dataset) or partition
+        with open(os.path.join(dataset_dir, "meta.json"), "w") as f:
+            json.dump({"partition": partition}, f)
+
+        data = self.local_times(data).dropna(how="all")
+        written = []
+        for key, new_data in data.groupby(data.index.strftime(PARTITION_FORMATS[partition])):
+            file = os.path.join(dataset_dir, f"{key}.csv")
+            if os.path.isfile(file):
+                stored = self.read_partition(file)
+                new_data = pd.concat([stored, new_data])
+                new_data = new_data[~new_data.index.duplicated(keep="last")]
+            temp_file = file + ".tmp"
+            new_data.sort_index().to_csv(temp_file)
+            os.replace(temp_file, file)
+            written.append(key)
+        return written
+
+    def read(self, dataset:str, start=None, end=None, columns:list=None) -> pd.DataFrame:
+        """
+        Data between start and end (both included, None for no bound), reading only the partitions in the range
+        and, with columns, only those columns.
+        """
+        partition = self.partition(dataset)
+        if partition is None:
+            raise FileNotFoundError(f"No data for {dataset} in {self.store_dir}")
+        key_format = PARTITION_FORMATS[partition]
+        start_key = pd.Timestamp(start).strftime(key_format) if start is not None else None
+        end_key = pd.Timestamp(end).strftime(key_format) if end is not None else None
+
+        files = [file for key, file in self.partitions(dataset) if (start_key is None or key >= start_key) and (end_key is None or key <= end_key)]
+        if not files:
+            return pd.DataFrame()
+        data = pd.concat([self.read_partition(file, columns) for file in files]).sort_index()
+        data.index.name = "Date" if partition == "month" else "Datetime"
+        return self.in_range(data, start, end)
+
+    @staticmethod
+    def in_range(data:pd.DataFrame, start=None, end=None) -> pd.DataFrame:
+        if start is not None:
+            data = data[data.index >= pd.Timestamp(start)]
+        if end is not None:
+            # a date as end includes the whole day
+            end = pd.Timestamp(end)
+            data = data[data.index < end + pd.Timedelta(days=1)] if end == end.normalize() else data[data.index <= end]
+        return data
+
+    def export(self, dataset:str, csv_file:str, start=None, end=None):
+        """
+        Write the data between start and end to a single csv file, in the layout read by the DataManager.
+        """
+        self.read(dataset, start, end).to_csv(csv_file)
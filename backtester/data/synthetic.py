@@ -0,0 +1,122 @@
+import logging
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+from ..config import BKTConfig
+
+# GICS sectors, assigned in turn to the synthetic tickers
+SECTORS = ["Information Technology", "Health Care", "Financials", "Consumer Discretionary", "Communication Services", "Industrials",
+           "Consumer Staples", "Energy", "Utilities", "Real Estate", "Materials"]
+
+
+class SyntheticDataGenerator:
+    """
+    Writes synthetic market data with the same csv layout as DataDownloader, so that the backtest can run offline.
+
+    Prices follow a one factor model: every stock has a beta on a market factor, which is also the path of "^GSPC".
+    The daily history ends on end_date; the intraday data (bars_per_day 2 minute bars from 09:30) covers
+    its last intraday_days days. A small share of the intraday prices is left empty, as in the yfinance data.
+    """
+    def __init__(self, bkt_config:BKTConfig, tickers_n:int=50, daily_days:int=130, intraday_days:int=40, bars_per_day:int=195,
+                 end_date:str="2024-11-29", missing_ratio:float=0.0005, seed:int=0):
+        self.bkt_config = bkt_config
+        self.tickers = [f"S{i:04d}" for i in range(tickers_n)]
+        self.index_ticker = "^GSPC"
+        self.daily_days = daily_days
+        self.intraday_days = intraday_days
+        self.bars_per_day = bars_per_day
+        self.end_date = end_date
+        self.missing_ratio = missing_ratio
+        self.rng = np.random.default_rng(seed)
+        self.betas = self.rng.uniform(0.5, 1.5, tickers_n)
+        self.logger = logging.getLogger(__name__)
+
+    def generate_data(self):
+        os.makedirs(self.bkt_config.data_dir, exist_ok=True)
+        days = pd.bdate_range(end=self.end_date, periods=self.daily_days)
+        self.generate_daily_data(days)
+        self.generate_intraday_data(days[-self.intraday_days:])
+        self.generate_sectors()
+        self.logger.info(f"Synthetic data for {len(self.tickers)} tickers written to {self.bkt_config.data_dir}")
+
+    def generate_sectors(self):
+        sectors = [SECTORS[i % len(SECTORS)] for i in range(len(self.tickers))]
+        pd.DataFrame({"ticker": self.tickers, "sector": sectors}).to_csv(self.bkt_config.sp500_sectors_file, index=False)
+
+    def factor_paths(self, steps:int, start_prices:np.ndarray, market_vol:float, idio_vol:float, drift:float=0.0):
+        """
+        Price paths of the index and of the stocks over steps periods.
+        """
+        market = self.rng.normal(drift, market_vol, (steps, 1))
+        stocks = market * self.betas + self.rng.normal(0, idio_vol, (steps, len(self.tickers)))
+        index_prices = start_prices[0] * np.exp(np.cumsum(market[:, 0]))
+        stocks_prices = start_prices[1:] * np.exp(np.cumsum(stocks, axis=0))
+        return index_prices, stocks_prices
+
+    def generate_daily_data(self, days:pd.DatetimeIndex):
+        start_prices = np.concatenate([[5000.0], self.rng.uniform(20, 500, len(self.tickers))])
+        index_prices, stocks_prices = self.factor_paths(len(days), start_prices, market_vol=0.01, idio_vol=0.012, drift=0.0003)
+
+        stocks_data = pd.DataFrame(stocks_prices, index=days, columns=self.tickers)
+        index_data = pd.DataFrame({self.index_ticker: index_prices}, index=days)
+        stocks_data.index.name = index_data.index.name = "Date"
+        stocks_data.to_csv(self.bkt_config.daily_stocks_file, float_format="%.4f")
+        index_data.to_csv(self.bkt_config.daily_index_file, float_format="%.4f")
+
+    def generate_intraday_data(self, days:pd.DatetimeIndex):
+        """
+        One day at a time, appended to the csv files, so that the large universes are never held in memory at once.
+        """
+        bars = pd.timedelta_range(start="09:30:00", periods=self.bars_per_day, freq="2min")
+        prices = np.concatenate([[5000.0], self.rng.uniform(20, 500, len(self.tickers))])
+
+        for count, day in enumerate(days):
+            index_prices, stocks_prices = self.factor_paths(self.bars_per_day, prices, market_vol=0.0008, idio_vol=0.001)
+            prices = np.concatenate([index_prices[-1:], stocks_prices[-1]])
+            missing = self.rng.random(stocks_prices.shape) < self.missing_ratio
+            stocks_prices[missing] = np.nan
+
+            timestamps = day + bars
+            stocks_data = pd.DataFrame(stocks_prices, index=timestamps, columns=self.tickers)
+            index_data = pd.DataFrame({self.index_ticker: index_prices}, index=timestamps)
+            stocks_data.index.name = index_data.index.name = "Datetime"
+
+            mode, header = ("w", True) if count == 0 else ("a", False)
+            stocks_data.to_csv(self.bkt_config.intraday_stocks_file, mode=mode, header=header, float_format="%.4f")
+            index_data.to_csv(self.bkt_config.intraday_index_file, mode=mode, header=header, float_format="%.4f")
+
+
+class SyntheticProvider:
+    """
+    Stand-in for YFinanceProvider serving synthetic close prices, e.g. to run DataDownloader offline.
+
+    Each ticker has its own random walk (seeded by its name), so the data does not depend on how the tickers
+    are chunked. failure_rate makes a share of the fetches fail, to exercise the retries.
+    """
+    def __init__(self, bars_per_day:int=195, failure_rate:float=0.0, seed:int=0):
+        self.bars_per_day = bars_per_day
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.failures_rng = np.random.default_rng(seed)
+
+    def timestamps(self, start, end, interval:str) -> pd.DatetimeIndex:
+        days = pd.bdate_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize() - pd.Timedelta(days=1))
+        if interval == "1d":
+            return days
+        bars = pd.timedelta_range(start="09:30:00", periods=self.bars_per_day, freq=interval.replace("m", "min"))
+        return pd.DatetimeIndex([day + bar for day in days for bar in bars])
+
+    def fetch(self, tickers:list, start, end, interval:str) -> pd.DataFrame:
+        if self.failures_rng.random() < self.failure_rate:
+            raise ConnectionError("synthetic provider failure")
+
+        timestamps = self.timestamps(start, end, interval)
+        volatility = 0.01 if interval == "1d" else 0.001
+        prices = {}
+        for ticker in tickers:
+            rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode())])
+            start_price = rng.uniform(20, 500)
+            prices[ticker] = start_price * np.exp(np.cumsum(rng.normal(0, volatility, len(timestamps))))
+        return pd.DataFrame(prices, index=timestamps)
@@ -0,0 +1,88 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from ..config import BKTConfig
+
+
+def read_sectors(sectors_file:str) -> pd.Series:
+    """
+    Sector of each ticker from sectors_file, a csv with a ticker and a sector column (as written by DataDownloader).
+    """
+    if not os.path.isfile(sectors_file):
+        raise FileNotFoundError(f"Sectors file not found: {sectors_file}")
+    sectors = pd.read_csv(sectors_file)
+    return pd.Series(sectors.iloc[:, 1].values, index=sectors.iloc[:, 0].values, name="sector")
+
+
+def as_list(setting) -> list:
+    # a single ticker or sector, e.g. --set universe_sectors=Energy
+    if isinstance(setting, str):
+        return [setting]
+    return list(setting)
+
+
+class UniverseSelector:
+    """
+    Tickers traded by the backtest, from the universe settings of BKTConfig:
+
+    - universe_tickers: explicit list of tickers (or a single ticker)
+    - universe_sectors: sectors of sp500_sectors_file (or a single sector)
+    - universe_min_price / universe_max_price: last daily close in the range
+    - universe_min_coverage: minimum share of non empty daily prices (a liquidity proxy, illiquid names miss prints)
+
+    The filters are combined. The price and coverage filters only see the daily prices before the first backtest day
+    (no look-ahead). They only need the daily prices, so the selection is known before the intraday file is read and
+    only its selected columns are loaded.
+    """
+    def __init__(self, config:BKTConfig) -> None:
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def is_restricted(self) -> bool:
+        config = self.config
+        return any(setting is not None for setting in (config.universe_tickers, config.universe_sectors, config.universe_min_price,
+                                                         config.universe_max_price, config.universe_min_coverage))
+
+    def select(self, daily_stocks:pd.DataFrame, backtest_start:pd.Timestamp=None) -> list:
+        """
+        Selected tickers among the columns of daily_stocks, in their order. The prices filters use the rows before
+        backtest_start (every row if None).
+        """
+        config = self.config
+        tickers = daily_stocks.columns
+        if backtest_start is not None:
+            # the intraday and daily files may not both carry a timezone, compare local dates as TradingCalendar does
+            backtest_start = pd.Timestamp(backtest_start)
+            if daily_stocks.index.tz is None and backtest_start.tz is not None:
+                backtest_start = backtest_start.tz_localize(None)
+            elif daily_stocks.index.tz is not None and backtest_start.tz is None:
+                backtest_start = backtest_start.tz_localize(daily_stocks.index.tz)
+            daily_stocks = daily_stocks[daily_stocks.index < backtest_start]
+        selected = np.ones(len(tickers), dtype=bool)
+
+        if config.universe_tickers is not None:
+            selected &= tickers.isin(as_list(config.universe_tickers))
+        if config.universe_sectors is not None:
+            sectors = read_sectors(config.sp500_sectors_file)
+            selected &= tickers.isin(sectors.index[sectors.isin(as_list(config.universe_sectors))])
+
+        if (config.universe_min_price is not None or config.universe_max_price is not None
+                or config.universe_min_coverage is not None) and daily_stocks.empty:
+            raise ValueError(f"No daily prices before {backtest_start} for the universe filters")
+        if config.universe_min_price is not None or config.universe_max_price is not None:
+            last_prices = daily_stocks.ffill().iloc[-1].to_numpy()
+            if config.universe_min_price is not None:
+                selected &= last_prices >= config.universe_min_price
+            if config.universe_max_price is not None:
+                selected &= last_prices <= config.universe_max_price
+        if config.universe_min_coverage is not None:
+            selected &= daily_stocks.notna().mean().to_numpy() >= config.universe_min_coverage
+
+        selected_tickers = list(tickers[selected])
+        self.logger.info(f"Universe: {len(selected_tickers)} of {len(tickers)} tickers selected")
+        if not selected_tickers:
+            raise ValueError("No ticker matches the universe settings")
+        return selected_tickers
@@ -0,0 +1,211 @@
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .cube import IntradayCube
+from .store import PARTITION_FORMATS, PartitionedStore
+
+
+def parse_timestamps(values) -> pd.DatetimeIndex:
+    # same parsing as DataManager.format_frame
+    return pd.DatetimeIndex(pd.to_datetime(pd.Series(values)))
+
+
+def empty_session(columns:list) -> pd.DataFrame:
+    return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([]), dtype=np.float64)
+
+
+class CsvSessionReader:
+    """
+    Reads an intraday csv one session (day) at a time.
+
+    A first pass reads only the timestamps and records the offset in the file of the first row of each session,
+    so that a session is then parsed on its own after a seek. The index is saved in index_file and reused while the
+    fingerprint of the csv is the same. The rows must be sorted by time, as in the downloaded files.
+    """
+    def __init__(self, source_file:str, index_file:str=None, fingerprint:dict=None) -> None:
+        self.source_file = source_file
+        self.fingerprint = fingerprint
+        with open(source_file) as f:
+            self.header = f.readline().rstrip("\r\n").split(",")
+
+        index = self.load_index(index_file, fingerprint) if index_file is not None else None
+        if index is None:
+            index = self.build_index()
+            if index_file is not None:
+                os.makedirs(os.path.dirname(index_file), exist_ok=True)
+                # one temporary file per writer, runs started together may all build the index
+                fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(index_file), suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, **index, fingerprint=json.dumps(fingerprint))
+                os.replace(tmp_file, index_file)
+
+        self.timestamps = parse_timestamps(index["timestamps"])
+        if not self.timestamps.is_monotonic_increasing:
+            raise ValueError(f"{source_file} is not sorted by time, it cannot be read by session")
+        self.offsets = index["offsets"]
+
+        sessions = self.timestamps.normalize()
+        self.row_start = np.flatnonzero(np.append(True, sessions[1:] != sessions[:-1])) if len(sessions) else np.array([], dtype=int)
+        self.row_stop = np.append(self.row_start[1:], len(sessions)).astype(int)
+        self.sessions = sessions[self.row_start]
+        self.session_lookup = {session: pos for pos, session in enumerate(self.sessions)}
+
+    @staticmethod
+    def load_index(index_file:str, fingerprint:dict) -> dict:
+        try:
+            with np.load(index_file) as index:
+                if json.loads(str(index["fingerprint"])) != fingerprint:
+                    return None
+                return {"timestamps": index["timestamps"], "offsets": index["offsets"]}
+        except FileNotFoundError:
+            return None
+
+    def build_index(self) -> dict:
+        timestamps, offsets = [], []
+        with open(self.source_file, "rb") as f:
+            offset = len(f.readline())
+            for line in f:
+                if line.strip():
+                    timestamps.append(line[: line.find(b",")].decode())
+                    offsets.append(offset)
+                offset += len(line)
+        return {"timestamps": np.array(timestamps), "offsets": np.array(offsets, dtype=np.int64)}
+
+    def read_session(self, session:pd.Timestamp, columns:list=None) -> pd.DataFrame:
+        """
+        Rows of the session (none if the file has no rows that day), with columns only those columns.
+        """
+        selected = set(columns) if columns is not None else None
+        usecols = [self.header[0]] + [column for column in self.header[1:] if selected is None or column in selected]
+        pos = self.session_lookup.get(session)
+        if pos is None:
+            return empty_session(usecols[1:])
+
+        with open(self.source_file, "rb") as f:
+            f.seek(self.offsets[self.row_start[pos]])
+            data = pd.read_csv(f, header=None, names=self.header, usecols=usecols, nrows=self.row_stop[pos] - self.row_start[pos])
+        data.index = parse_timestamps(data.pop(self.header[0]))
+        return data
+
+
+class StoreSessionReader:
+    """
+    Same as CsvSessionReader on a dataset of the partitioned store partitioned by day: a session is a partition.
+    Only the partitions between start and end are read, as in PartitionedStore.read.
+    """
+    def __init__(self, store:PartitionedStore, dataset:str, start=None, end=None) -> None:
+        if store.partition(dataset) != "day":
+            raise ValueError(f"{dataset} is not partitioned by day in {store.store_dir}")
+        self.start = start
+        self.end = end
+        key_format = PARTITION_FORMATS["day"]
+        start_key = pd.Timestamp(start).strftime(key_format) if start is not None else None
+        end_key = pd.Timestamp(end).strftime(key_format) if end is not None else None
+
+        self.files = {}
+        timestamps = []
+        for key, file in store.partitions(dataset):
+            if (start_key is None or key >= start_key) and (end_key is None or key <= end_key):
+                index = store.in_range(pd.DataFrame(index=parse_timestamps(pd.read_csv(file, usecols=[0]).iloc[:, 0])), start, end).index
+                if len(index):
+                    self.files[pd.Timestamp(key)] = file
+                    timestamps.append(index)
+        self.header = pd.read_csv(next(iter(self.files.values())), nrows=0).columns.tolist() if self.files else []
+        self.timestamps = timestamps[0].append(timestamps[1:]) if timestamps else pd.DatetimeIndex([])
+        self.sessions = pd.DatetimeIndex(list(self.files))
+        self.fingerprint = {"partitions": [(key.strftime(key_format), os.path.getsize(file), os.stat(file).st_mtime_ns) for key, file in self.files.items()],
+                            "start": str(start), "end": str(end)}
+
+    def read_session(self, session:pd.Timestamp, columns:list=None) -> pd.DataFrame:
+        file = self.files.get(session)
+        if file is None:
+            selected = set(columns) if columns is not None else None
+            return empty_session([column for column in self.header[1:] if selected is None or column in selected])
+        return PartitionedStore.in_range(PartitionedStore.read_partition(file, columns).sort_index(), self.start, self.end)
+
+
+class DayWindowArray:
+    """
+    Array-like view of a WindowedIntradayCube (values or mask): the first index is a day position and
+    only loads that day, e.g. values[day_pos], values[day_pos, bar] or values[day_pos, :, column].
+    """
+    def __init__(self, cube:'WindowedIntradayCube', name:str) -> None:
+        self.cube = cube
+        self.name = name
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self.cube.days), len(self.cube.bars), len(self.cube.tickers))
+
+    def __len__(self) -> int:
+        return len(self.cube.days)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            day_pos, rest = key[0], key[1:]
+        else:
+            day_pos, rest = key, ()
+        day_values = self.cube.load_day(int(day_pos))[self.name]
+        return day_values[rest] if rest else day_values
+
+
+class WindowedIntradayCube(IntradayCube):
+    """
+    IntradayCube whose days are read from the source when they are first needed: only the last window_days
+    sessions are kept in memory (least recently used first out). The days x bars grid is the same as the in-memory
+    cube, so the algo sees the same prices; the analyses keep their own rolling window of returns, so the memory
+    depends on the length of the windows, not on the length of the history.
+    """
+    def __init__(self, reader, days:pd.DatetimeIndex, bars:pd.TimedeltaIndex, tickers:list, dtype=np.float64, window_days:int=2,
+                 resample_minutes:int=None) -> None:
+        # bars are those of the data, the sessions are resampled to resample_minutes bars when they are loaded
+        self.source_bars = bars
+        self.resample_minutes = resample_minutes
+        if resample_minutes is not None:
+            bars = self.resampled_bars(bars, resample_minutes)[0]
+        super().__init__(DayWindowArray(self, "values"), DayWindowArray(self, "mask"), days, bars, tickers)
+        self.reader = reader
+        self.dtype = dtype
+        self.window_days = window_days
+        self.loaded_days = OrderedDict()
+
+    def load_day(self, day_pos:int) -> dict:
+        if day_pos in self.loaded_days:
+            self.loaded_days.move_to_end(day_pos)
+            return self.loaded_days[day_pos]
+
+        day = self.days[day_pos : day_pos + 1]
+        frame = self.reader.read_session(day[0], self.tickers)[self.tickers]
+        cube = IntradayCube.from_frame(frame, day, self.source_bars, self.dtype)
+        if self.resample_minutes is not None:
+            cube = cube.resample(self.resample_minutes)
+        self.loaded_days[day_pos] = {"values": cube.values[0], "mask": cube.mask[0]}
+        while len(self.loaded_days) > self.window_days:
+            self.loaded_days.popitem(last=False)
+        return self.loaded_days[day_pos]
+
+    def bar_minutes(self) -> float:
+        if self.resample_minutes is not None:
+            return float(self.resample_minutes)
+        return self.bar_size(self.source_bars)
+
+    def resample(self, minutes:int) -> 'WindowedIntradayCube':
+        # always from the bars of the data
+        bar_minutes = self.bar_size(self.source_bars)
+        if bar_minutes is not None and minutes < bar_minutes:
+            raise ValueError(f"Cannot resample {bar_minutes:g} minutes bars to {minutes} minutes")
+        return WindowedIntradayCube(self.reader, self.days, self.source_bars, self.tickers, self.dtype, self.window_days, minutes)
+
+    def fingerprint_arrays(self) -> list:
+        # hashing the prices would read the whole history, the fingerprint of the source files stands for them
+        return [np.array([json.dumps(self.reader.fingerprint, sort_keys=True)]), self.tickers]
+
+    def save(self, path:str):
+        # the prices are never all in memory, there is nothing to save
+        raise TypeError("A WindowedIntradayCube cannot be saved: save a fully loaded cube with IntradayCube.save "
+                        "(price_storage = \"memory\" or \"mmap\")")
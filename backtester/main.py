@@ -1,75 +1,243 @@
 import logging
-from datetime import datetime
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
-import sys
 import os 
 from backtester.config import BKTConfig
-from backtester.data.manager import DataManager
+from backtester.data.calendar import backtest_start, shift_months
+from backtester.data.manager import DataManager, MarketData
 from trading_algo.algo import TradingAlgo
-import backtester.utils as utils
+from backtester.checkpoint import load_checkpoint, save_checkpoint
+from backtester.parallel import backtest_pool, worker_market_data
 
 class Backtester: 
-    def __init__(self, trading_algo:TradingAlgo) -> None:
+    """
+    With variants, one pass drives several algos: the analyses of trading_algo are computed once per day and
+    shared by the variants (see TradingAlgo.share_analysis), each algo then builds and trades its own portfolio.
+    """
+    def __init__(self, trading_algo:TradingAlgo, variants:list=None) -> None:
         self.algo = trading_algo
+        self.variants = variants or []
+        for variant in self.variants:
+            variant.share_analysis(self.algo)
         
         self.backtest_days = self.get_backtest_days()
+        for algo in self.algos:
+            algo.ledger.reserve(len(self.backtest_days))
+
+    @property
+    def algos(self) -> list:
+        return [self.algo] + self.variants
         
 
     def get_backtest_days(self): 
-        first_day = datetime.strftime(self.algo.intraday_stocks.index.date[0] + pd.DateOffset(days=15), format="%Y-%m-%d")
+        first_day = backtest_start(self.algo.intraday_stocks.index[0]).strftime("%Y-%m-%d")
 
         backtest_days = self.algo.intraday_stocks.loc[first_day:]
         return sorted(set(backtest_days.index.date), reverse=False)
 
-    def start_backtest(self): 
+    def initialize_start_dates(self):
+        first_day = np.datetime64(self.backtest_days[0], "D")
+        for algo in self.algos:
+            algo.start_date_daily = shift_months(first_day, -3)
+            algo.start_date_intraday = shift_months(first_day, -1)
+
+    def get_state(self) -> dict:
+        state = self.algo.get_state()
+        if self.variants:
+            # the analyses are shared, the variants only carry their rankings and results
+            state["variants"] = [variant.get_state()["algo"] for variant in self.variants]
+        return state
+
+    def set_state(self, state:dict):
+        self.algo.set_state(state)
+        for variant, variant_state in zip(self.variants, state.get("variants", [])):
+            for name, value in variant_state.items():
+                setattr(variant, name, value)
+
+    def start_backtest(self, show_progress=True, resume=False): 
         """
-        For each day we convert the date to a string... For the moment it is too much refactoring to use only datetimes
+        With resume the algo state is restored from the last checkpoint and the backtest goes on from the next day.
         """
+        backtest_days = self.backtest_days
+        checkpoint_file = self.algo.bkt_config.checkpoint_file
 
-        self.algo.start_date_daily = datetime.strftime(self.backtest_days[0] - pd.DateOffset(months=3), format="%Y-%m-%d")
-        self.algo.start_date_intraday = datetime.strftime(self.backtest_days[0] - pd.DateOffset(months=1), format="%Y-%m-%d")
-        
-        for date in tqdm(self.backtest_days): # We should not use trading_day because we can use date
-            date = datetime.strftime(date, "%Y-%m-%d")
+        if resume and os.path.isfile(checkpoint_file):
+            snapshot = load_checkpoint(checkpoint_file)
+            self.set_state(snapshot["state"])
+            backtest_days = [day for day in self.backtest_days if day > snapshot["last_day"]]
+            logging.getLogger(__name__).info(f"Resuming from checkpoint after {snapshot['last_day']}")
+        else:
+            self.initialize_start_dates()
+
+        self.run_days(backtest_days, show_progress, checkpoints=True)
+
+        report_file = self.algo.profiler.write_report(self.algo.bkt_config.results_dir)
+        if report_file:
+            logging.getLogger(__name__).info(f"Profiling report saved to {report_file}")
 
+    def run_days(self, backtest_days, show_progress=True, checkpoints=False): 
+        """
+        The days are converted once to their calendar positions, the algo only works with integer offsets.
+        """
+        checkpoint_every = self.algo.bkt_config.checkpoint_every
+        profiler = self.algo.profiler
+        streaming = [algo.algo_params.EXECUTION_MODE == "streaming" for algo in self.algos]
+        positions = self.algo.calendar.positions(backtest_days)
+
+        if show_progress:
+            # imported only for the interactive runs
+            from tqdm import tqdm
+            progress = tqdm(backtest_days)
+        else:
+            progress = backtest_days
+        for count, (day, day_pos) in enumerate(zip(progress, positions), start=1):
             if not self.algo.stop(): 
                 # Let the algo perform its actions
-                self.algo.run(date)
+                profiler.start_day(day)
+                if not self.variants:
+                    self.algo.run(day_pos, self.intraday_bars(day_pos) if streaming[0] else None)
+                else:
+                    self.algo.analyse(day_pos)
+                    for algo, algo_streaming in zip(self.algos, streaming):
+                        algo.trade(day_pos, self.intraday_bars(day_pos) if algo_streaming else None)
+                if profiler.enabled and show_progress:
+                    progress.set_postfix(profiler.last_day_postfix(), refresh=False)
 
+            if checkpoints and checkpoint_every and count % checkpoint_every == 0:
+                save_checkpoint(self.algo.bkt_config.checkpoint_file, day, self.get_state())
 
-def main():
-    # Initialize logging
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-    logger = logging.getLogger(__name__)
-    
-    # Ensure data availability
-    utils.ensure_data_availability()
+    def intraday_bars(self, day_pos:int):
+        """
+        Replay of the intraday data of the day, one (timestamp, stocks prices, index price) bar at a time.
+        """
+        intraday_cube = self.algo.intraday_cube
+        timestamps = intraday_cube.timestamps(day_pos)
+        for bar, timestamp in enumerate(timestamps):
+            yield timestamp, intraday_cube.values[day_pos, bar], self.algo.intraday_index_cube.values[day_pos, bar, 0]
 
-    logger.info("Starting Simplified Event-Based Backtest...")
-    
-    # Load configuration
-    logger.debug("Loading Configuration")
-    bkt_config = BKTConfig() 
+    def run_segment(self, first_day, last_day, warmup_days=None, show_progress=False): 
+        """
+        Backtest only the days between first_day and last_day (both included), so that disjoint segments can run concurrently.
 
-    # Load data
-    logger.info("Loading data...")
+        The state carried from one day to the next is rebuilt before the segment, the results of those days are discarded:
+        - the analyses (their ewm series cover the whole history) run on every previous day, without trading
+        - the Borda scores add up from the last daily ranking reset, the algo trades from the day after it
+          (or on the warmup_days preceding the segment, if given, with a warning if the reset is further back)
+        - the average index drawdown that drives the intraday exits is seeded from the days before the warm up
+        The average portfolio drawdown of the segment is the mean of the daily drawdowns of its own days.
+        """
+        segment_start = next(pos for pos, day in enumerate(self.backtest_days) if day >= first_day)
+        positions = self.algo.calendar.positions(self.backtest_days[:segment_start])
+
+        # start dates schedule up to the segment
+        self.initialize_start_dates()
+        ranking_start = 0
+        for count, day_pos in enumerate(positions, start=1):
+            if self.algo.reset_daily_ranking(day_pos):
+                ranking_start = count
+            self.algo.update_start_dates(day_pos)
+
+        warmup_start = ranking_start
+        if warmup_days is not None:
+            warmup_start = max(0, segment_start - warmup_days)
+            if warmup_start > ranking_start:
+                logging.getLogger(__name__).warning(
+                    f"Segment from {first_day}: the warm up starts {warmup_start - ranking_start} days after the last ranking reset, "
+                    f"the rankings will differ from the full backtest")
+
+        self.initialize_start_dates()
+        for day_pos in positions[:warmup_start]:
+            # the analyses are shared by the variants
+            self.algo.analyse(day_pos)
+            for algo in self.algos:
+                algo.update_start_dates(day_pos)
+        for algo in self.algos:
+            algo.ranking.reset()
+            algo.seed_index_drawdowns(positions[:warmup_start])
+
+        self.run_days(self.backtest_days[warmup_start:segment_start], show_progress)
+        for algo in self.algos:
+            algo.reset_results()
+
+        self.run_days([day for day in self.backtest_days[segment_start:] if day <= last_day], show_progress)
+        for algo in self.algos:
+            # the running average also counts the days before the segment
+            daily = algo.ledger.daily
+            algo.avg_drawdown = float(daily["prt_max_drawdown"].mean()) if len(daily) else 0
+
+
+def _run_segment(first_day, last_day, warmup_days, bkt_config:BKTConfig, algo_params=None) -> dict:
+    algo = TradingAlgo(bkt_config, worker_market_data(), algo_params)
+    Backtester(algo).run_segment(first_day, last_day, warmup_days)
+    return {"first_day": first_day, "last_day": last_day, **algo.summary()}
+
+
+def run_segments(bkt_config:BKTConfig, segments_number:int, warmup_days=None, workers=None, market_data:MarketData=None,
+                 algo_params=None) -> pd.DataFrame:
+    """
+    Split the backtest days in segments_number disjoint segments and run them concurrently, one row per segment.
+    By default each segment is warmed up from the last ranking reset before it, see Backtester.run_segment.
+    """
+    if market_data is None:
+        market_data = load_market_data(bkt_config)
+    backtest_days = Backtester(TradingAlgo(bkt_config, market_data, algo_params)).backtest_days
+    segments = [list(segment) for segment in np.array_split(np.array(backtest_days, dtype=object), segments_number) if len(segment)]
+
+    with backtest_pool(bkt_config, workers or segments_number, market_data) as executor:
+        futures = [executor.submit(_run_segment, segment[0], segment[-1], warmup_days, bkt_config, algo_params) for segment in segments]
+        results = [future.result() for future in futures]
+
+    return pd.DataFrame(results)
+
+
+def load_market_data(bkt_config:BKTConfig) -> MarketData:
+    """
+    Load, format and clean the market data and build the intraday cubes.
+    """
     data_manager = DataManager(bkt_config)
     data_manager.load_data()
 
     # Format and Clean data
-    logger.info("Formatting and cleaning data")
     data_manager.format_data()
     data_manager.clean_data()
+    data_manager.build_intraday_cubes()
+    return data_manager.return_data()
+
+
+def backtest(bkt_config:BKTConfig, algo_params=None, resume=False, show_progress=True) -> TradingAlgo:
+    """
+    Full backtest: check the data, load it, run the algo and export its results.
+    """
+    import backtester.utils as utils
+
+    logger = logging.getLogger(__name__)
+    
+    # Ensure data availability
+    utils.ensure_data_availability(bkt_config)
+
+    logger.info("Starting Simplified Event-Based Backtest...")
+
+    # Load data
+    logger.info("Loading data...")
+    market_data = load_market_data(bkt_config)
 
     # Initialize the trading algorithm
     logger.info("Initializing Trading Algorithm")
-    trading_algo = TradingAlgo(bkt_config, data_manager.return_data())
-    del data_manager
+    trading_algo = TradingAlgo(bkt_config, market_data, algo_params)
 
     backtester = Backtester(trading_algo)
 
-    backtester.start_backtest()
+    backtester.start_backtest(show_progress=show_progress, resume=resume)
+
+    results_files = trading_algo.ledger.export(bkt_config.results_dir, bkt_config.results_format)
+    logger.info(f"Results saved to {', '.join(results_files)}")
+    return trading_algo
+
+
+def main():
+    # Initialize logging
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    backtest(BKTConfig())
 
     
 if __name__ == "__main__":
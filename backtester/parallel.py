@@ -0,0 +1,38 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from backtester.config import BKTConfig
+from backtester.data.manager import MarketData
+
+# Market data of the worker processes. With the fork start method it is inherited from the parent
+# (copy-on-write, never pickled), otherwise each worker loads it once in its initializer,
+# which only maps the binary cache when BKTConfig.price_storage is "mmap".
+_market_data = None
+
+
+def _init_worker(bkt_config:BKTConfig):
+    global _market_data
+    if _market_data is None:
+        from backtester.main import load_market_data
+        _market_data = load_market_data(bkt_config)
+
+
+def worker_market_data() -> MarketData:
+    return _market_data
+
+
+def backtest_pool(bkt_config:BKTConfig, workers:int, market_data:MarketData=None) -> ProcessPoolExecutor:
+    """
+    Process pool whose workers share the market data of the parent process when possible.
+    """
+    global _market_data
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        if market_data is None:
+            from backtester.main import load_market_data
+            market_data = load_market_data(bkt_config)
+        _market_data = market_data
+    else:
+        context = multiprocessing.get_context("spawn")
+
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(bkt_config,))
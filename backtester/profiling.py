@@ -0,0 +1,102 @@
+import contextlib
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+
+class StageProfiler:
+    """
+    Wall clock and CPU time of the stages of TradingAlgo.run, for each backtest day.
+
+    With track_memory the peak memory allocated by python during each stage is recorded too (tracemalloc,
+    which slows the run down). A disabled profiler hands out the same empty context for every stage,
+    so that the instrumented code costs one method call per stage.
+    """
+    def __init__(self, enabled:bool=False, track_memory:bool=False) -> None:
+        self.enabled = enabled
+        self.track_memory = enabled and track_memory
+        self.days = []
+        self.current_day = None
+        self._disabled_stage = contextlib.nullcontext()
+
+    def start_day(self, date):
+        if self.enabled:
+            self.current_day = {"date": str(date), "stages": {}}
+            self.days.append(self.current_day)
+
+    def stage(self, name:str):
+        if not self.enabled or self.current_day is None:
+            return self._disabled_stage
+        return self._measure(name)
+
+    @contextlib.contextmanager
+    def _measure(self, name:str):
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            timings = {"wall": time.perf_counter() - wall_start, "cpu": time.process_time() - cpu_start}
+            if self.track_memory:
+                timings["peak_memory"] = tracemalloc.get_traced_memory()[1] - start_memory
+            # a stage run several times in a day (once per variant) is summed
+            previous = self.current_day["stages"].get(name)
+            if previous is not None:
+                timings = {key: max(value, previous[key]) if key == "peak_memory" else value + previous[key] for key, value in timings.items()}
+            self.current_day["stages"][name] = timings
+
+    def last_day_postfix(self) -> dict:
+        """
+        Wall clock milliseconds of the stages of the last day, for the progress bar.
+        """
+        if not self.days:
+            return {}
+        return {name: f"{timings['wall'] * 1000:.0f}ms" for name, timings in self.days[-1]["stages"].items()}
+
+    def stage_summary(self) -> dict:
+        stages = {}
+        for day in self.days:
+            for name, timings in day["stages"].items():
+                stages.setdefault(name, []).append(timings)
+
+        summary = {}
+        for name, timings in stages.items():
+            wall = np.array([t["wall"] for t in timings])
+            cpu = np.array([t["cpu"] for t in timings])
+            summary[name] = {
+                "days": len(timings),
+                "total_wall": float(wall.sum()),
+                "mean_wall": float(wall.mean()),
+                "max_wall": float(wall.max()),
+                "total_cpu": float(cpu.sum()),
+            }
+            if self.track_memory:
+                summary[name]["max_peak_memory"] = int(max(t["peak_memory"] for t in timings))
+
+        total_wall = sum(stage["total_wall"] for stage in summary.values())
+        for stage in summary.values():
+            stage["share"] = stage["total_wall"] / total_wall if total_wall else 0.0
+        return summary
+
+    def write_report(self, results_dir:str) -> str:
+        """
+        Write the stages summary and the per day timings to results_dir/profile.json.
+        """
+        if not self.enabled:
+            return None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        os.makedirs(results_dir, exist_ok=True)
+        report_file = os.path.join(results_dir, "profile.json")
+        with open(report_file, "w") as f:
+            json.dump({"stages": self.stage_summary(), "days": self.days}, f, indent=2)
+        return report_file
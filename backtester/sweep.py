@@ -0,0 +1,168 @@
+import copy
+import itertools
+import logging
+import os
+from concurrent.futures import as_completed
+
+import numpy as np
+import pandas as pd
+
+from backtester.config import BKTConfig
+from backtester.data.manager import MarketData
+from backtester.main import Backtester, load_market_data
+from backtester.parallel import backtest_pool, worker_market_data
+from trading_algo.algo import TradingAlgo
+from trading_algo.exits import ExitRuleGrid
+from trading_algo.parameters import AlgoParameters
+
+
+# Defined in AlgoParameters / BKTConfig but not read by the algo yet: sweeping them would only repeat the same backtest
+UNUSED_PARAMETERS = ["LONG_TREND_DAYS", "RANKING_DAYS", "RESHUFFLE_FREQUENCY", "intraday_days_buffer"]
+
+
+def check_parameters(names):
+    unused = [name for name in names if name in UNUSED_PARAMETERS]
+    if unused:
+        raise ValueError(f"Not used by the algo, cannot be swept: {', '.join(unused)}")
+
+
+def apply_parameters(parameters:dict, bkt_config:BKTConfig, algo_params:AlgoParameters):
+    """
+    Set each parameter on AlgoParameters and/or BKTConfig, wherever it is defined.
+    """
+    check_parameters(parameters)
+    for name, value in parameters.items():
+        found = False
+        for target in (algo_params, bkt_config):
+            if hasattr(target, name):
+                setattr(target, name, value)
+                found = True
+        if not found:
+            raise ValueError(f"Unknown parameter: {name}")
+
+
+def _run_configuration(config_id:int, parameters:dict, bkt_config:BKTConfig, algo_params:AlgoParameters=None) -> dict:
+    bkt_config = copy.deepcopy(bkt_config)
+    algo_params = copy.deepcopy(algo_params) if algo_params is not None else AlgoParameters()
+    apply_parameters(parameters, bkt_config, algo_params)
+
+    algo = TradingAlgo(bkt_config, worker_market_data(), algo_params)
+    Backtester(algo).start_backtest(show_progress=False)
+
+    return {"config_id": config_id, **parameters, **algo.summary()}
+
+
+class ParameterSweep:
+    """
+    Runs one backtest per parameter configuration over a process pool.
+
+    grid maps parameter names (attributes of AlgoParameters or BKTConfig) to the list of values to try.
+    Every combination is run, unless n_random is given: then n_random combinations are drawn at random.
+    The configurations start from algo_params (the defaults if None).
+    """
+    def __init__(self, bkt_config:BKTConfig, grid:dict, n_random:int=None, seed:int=0, workers:int=None, algo_params:AlgoParameters=None):
+        check_parameters(grid)
+        self.bkt_config = bkt_config
+        self.algo_params = algo_params
+        self.grid = grid
+        self.n_random = n_random
+        self.seed = seed
+        self.workers = workers or os.cpu_count()
+        self.logger = logging.getLogger(__name__)
+
+    def configurations(self) -> list:
+        names = list(self.grid.keys())
+        combinations = list(itertools.product(*self.grid.values()))
+        if self.n_random is not None and self.n_random < len(combinations):
+            rng = np.random.default_rng(self.seed)
+            picked = rng.choice(len(combinations), size=self.n_random, replace=False)
+            combinations = [combinations[i] for i in sorted(picked)]
+        return [dict(zip(names, values)) for values in combinations]
+
+    def run(self, market_data:MarketData=None) -> pd.DataFrame:
+        configurations = self.configurations()
+        self.logger.info(f"Running {len(configurations)} configurations on {self.workers} workers")
+
+        results = []
+        with backtest_pool(self.bkt_config, self.workers, market_data) as executor:
+            futures = [executor.submit(_run_configuration, config_id, parameters, self.bkt_config, self.algo_params) for config_id, parameters in enumerate(configurations)]
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    self.logger.error(f"Configuration failed: {e}")
+
+        summary = pd.DataFrame(results)
+        if not summary.empty:
+            summary = summary.sort_values("config_id").set_index("config_id")
+        return summary
+
+
+def exit_rule_sweep(bkt_config:BKTConfig, take_profits:list, stop_losses:list, drawdown_multipliers:list,
+                    market_data:MarketData=None, algo_params:AlgoParameters=None) -> pd.DataFrame:
+    """
+    Results of every combination of exit rules, from a single backtest. One row per rule.
+    """
+    if market_data is None:
+        market_data = load_market_data(bkt_config)
+    algo_params = copy.deepcopy(algo_params) if algo_params is not None else AlgoParameters()
+    # the grid needs the whole session path of each day
+    algo_params.EXECUTION_MODE = "batch"
+
+    algo = TradingAlgo(bkt_config, market_data, algo_params)
+    algo.exit_grid = ExitRuleGrid(take_profits, stop_losses, drawdown_multipliers)
+    Backtester(algo).start_backtest(show_progress=False)
+    return algo.exit_grid.results()
+
+
+def variant_backtest(bkt_config:BKTConfig, variants:list, market_data:MarketData=None) -> pd.DataFrame:
+    """
+    Results of several strategy variants from a single backtest pass, one row per variant. Each variant is a dict of
+    AlgoParameters / BKTConfig values (e.g. instruments_number, INCLUDE_INDEX, DAILY_RANK_WEIGHT, the exit rules):
+    the analyses are computed once per day and only the portfolio construction and the trading run per variant,
+    so the parameters of TradingAlgo.FEATURE_PARAMETERS must be the same for all of them.
+    """
+    if market_data is None:
+        market_data = load_market_data(bkt_config)
+
+    algos = []
+    for parameters in variants:
+        variant_config = copy.deepcopy(bkt_config)
+        algo_params = AlgoParameters()
+        apply_parameters(parameters, variant_config, algo_params)
+        algos.append(TradingAlgo(variant_config, market_data, algo_params))
+
+    Backtester(algos[0], algos[1:]).start_backtest(show_progress=False)
+    return pd.DataFrame([{"variant_id": variant_id, **parameters, **algo.summary()} for variant_id, (parameters, algo) in enumerate(zip(variants, algos))]).set_index("variant_id")
+
+
+DEFAULT_GRID = {
+    "DAILY_EWM_WINDOW": [5, 10, 20],
+    "DAILY_STD_EWM_SPAN": [5, 10],
+    "INTRADAY_EWM_SPAN": [3, 5],
+    "instruments_number": [5, 10],
+}
+
+
+def sweep(bkt_config:BKTConfig, grid:dict=None, n_random:int=None, workers:int=None, algo_params:AlgoParameters=None) -> pd.DataFrame:
+    """
+    Run the sweep and save its results to results_dir/sweep_results.csv.
+    """
+    logger = logging.getLogger(__name__)
+    summary = ParameterSweep(bkt_config, grid or DEFAULT_GRID, n_random=n_random, workers=workers, algo_params=algo_params).run()
+
+    os.makedirs(bkt_config.results_dir, exist_ok=True)
+    results_file = os.path.join(bkt_config.results_dir, "sweep_results.csv")
+    summary.to_csv(results_file)
+    logger.info(f"Sweep results saved to {results_file}")
+    return summary
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    summary = sweep(BKTConfig())
+    print(summary.sort_values("pnl", ascending=False).to_string())
+
+
+if __name__ == "__main__":
+    main()
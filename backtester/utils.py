@@ -1,17 +1,24 @@
+import logging
 import os
 
 import pandas as pd
 from backtester.config import BKTConfig
 from backtester.data.downloader import DataDownloader
+from backtester.data.store import PartitionedStore
 
-bkt_config = BKTConfig()
 
-def ensure_data_availability():
+def ensure_data_availability(bkt_config:BKTConfig):
     """
     Check if data files exist in the 'data' folder. If not, run the data downloader.
     """
     data_folder = bkt_config.data_dir
 
+    if bkt_config.data_source == "store":
+        if PartitionedStore(bkt_config.data_store_dir).partition("intraday_stocks") is None:
+            print("The data store is empty, downloading the data...")
+            update_data(bkt_config)
+        return
+
     required_files = [
         bkt_config.daily_stocks_file,
         bkt_config.intraday_stocks_file,
@@ -32,4 +39,46 @@ def ensure_data_availability():
         downloader.download_data()
         print("Data download completed.")
     else:
-        print("All required data files are present.")
\ No newline at end of file
+        print("All required data files are present.")
+
+def update_data(bkt_config:BKTConfig):
+    """
+    Append the bars published since the last update to the data store and refresh the csv files.
+    """
+    downloader = DataDownloader(bkt_config)
+    return downloader.update_data(export=bkt_config.data_source == "csv")
+
+
+def convert_data(bkt_config:BKTConfig, target:str="cache") -> list:
+    """
+    Convert the csv files once, ahead of the backtests: "cache" writes the binary cache (and the memory mapped
+    cubes with price_storage = "mmap"), "store" imports the csv files in the partitioned data store.
+    """
+    from backtester.data.manager import DataManager
+
+    logger = logging.getLogger(__name__)
+    if target == "cache":
+        bkt_config.use_data_cache = True
+        data_manager = DataManager(bkt_config)
+        data_manager.load_data()
+        data_manager.format_data()
+        if bkt_config.price_storage == "mmap":
+            data_manager.build_intraday_cubes()
+        logger.info(f"Binary cache up to date in {bkt_config.data_cache_dir}")
+        return [bkt_config.data_cache_dir]
+
+    if target == "store":
+        store = PartitionedStore(bkt_config.data_store_dir)
+        datasets = [
+            ("daily_stocks", bkt_config.daily_stocks_file, "month"),
+            ("daily_index", bkt_config.daily_index_file, "month"),
+            ("intraday_stocks", bkt_config.intraday_stocks_file, "day"),
+            ("intraday_index", bkt_config.intraday_index_file, "day"),
+        ]
+        for name, csv_file, partition in datasets:
+            data = DataManager.format_frame(pd.read_csv(csv_file))
+            partitions = store.append(name, data, partition=partition)
+            logger.info(f"{name}: {len(partitions)} partitions written to {store.dataset_dir(name)}")
+        return [store.dataset_dir(name) for name, _, _ in datasets]
+
+    raise ValueError(f"Unknown conversion target: {target}")
@@ -0,0 +1,200 @@
+"""
+Offline benchmarks of the backtest on synthetic data.
+
+    python -m benchmarks.run --scales 50 500 3000
+    python -m benchmarks.run --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+The synthetic data of each scale is generated once in benchmarks/fixtures/<tickers>. The timings are saved in
+benchmarks/results/<commit>.json, so that the results of two commits can be compared.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from backtester.config import BKTConfig
+from backtester.data.manager import DataManager
+from backtester.data.synthetic import SyntheticDataGenerator
+from backtester.main import Backtester
+from trading_algo.algo import TradingAlgo
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARKS_DIR)
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+
+
+def git_revision() -> dict:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS_DIR, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCHMARKS_DIR, text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = "unknown", False
+    return {"commit": commit, "dirty": dirty}
+
+
+def fixture_config(tickers_n:int, daily_days:int, intraday_days:int) -> BKTConfig:
+    """
+    Config reading the synthetic data of the given scale, generated if it is not there yet.
+    """
+    fixture_dir = os.path.join(FIXTURES_DIR, f"{tickers_n}_{daily_days}_{intraday_days}")
+    bkt_config = BKTConfig(data_dir=fixture_dir, results_dir=os.path.join(fixture_dir, "results"))
+    if not os.path.isfile(bkt_config.intraday_index_file):
+        start = time.perf_counter()
+        SyntheticDataGenerator(bkt_config, tickers_n, daily_days, intraday_days).generate_data()
+        logging.info(f"{tickers_n} tickers: fixture generated in {time.perf_counter() - start:.1f}s")
+    return bkt_config
+
+
+def timed(function, repeat:int=1) -> tuple:
+    """
+    Best wall clock time over repeat calls, and the result of the last call.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def load_market_data(bkt_config:BKTConfig):
+    data_manager = DataManager(bkt_config)
+    data_manager.load_data()
+    data_manager.format_data()
+    data_manager.clean_data()
+    return data_manager
+
+
+def benchmark_scale(tickers_n:int, daily_days:int, intraday_days:int, repeat:int) -> dict:
+    bkt_config = fixture_config(tickers_n, daily_days, intraday_days)
+    results = {"tickers": tickers_n, "daily_days": daily_days, "intraday_days": intraday_days}
+
+    # csv parsing, then the binary cache (the first cached load writes it)
+    bkt_config.use_data_cache = False
+    results["load_data_csv"], _ = timed(lambda: load_market_data(bkt_config), repeat)
+    bkt_config.use_data_cache = True
+    load_market_data(bkt_config)
+    results["load_data_cache"], data_manager = timed(lambda: load_market_data(bkt_config), repeat)
+
+    results["build_intraday_cubes"], _ = timed(data_manager.build_intraday_cubes, repeat)
+    market_data = data_manager.return_data()
+
+    # full backtest, with the stages timed by the profiler
+    bkt_config.profile = True
+    results["algo_init"], algo = timed(lambda: TradingAlgo(bkt_config, market_data))
+    backtester = Backtester(algo)
+    results["start_backtest"], _ = timed(lambda: backtester.start_backtest(show_progress=False))
+    results["backtest_days"] = len(backtester.backtest_days)
+    results["stages"] = algo.profiler.stage_summary()
+    results["pnl"] = float(algo.total_return)
+    return results
+
+
+def startup_times(repeat:int) -> dict:
+    """
+    Wall clock time of fresh python processes: the interpreter alone, the CLI help and the import of the backtester.
+    """
+    commands = {
+        "python": [sys.executable, "-c", "pass"],
+        "cli_help": [sys.executable, "-m", "backtester", "--help"],
+        "import_backtester": [sys.executable, "-c", "import backtester.main"],
+    }
+    times = {}
+    for name, command in commands.items():
+        times[name], _ = timed(lambda: subprocess.run(command, cwd=REPOSITORY_DIR, check=True, capture_output=True), max(repeat, 3))
+    return times
+
+
+def run(scales:list, daily_days:int, intraday_days:int, repeat:int) -> str:
+    report = {
+        **git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "startup": startup_times(repeat),
+        "scales": [],
+    }
+    logging.info("Startup: " + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in report["startup"].items()))
+    for tickers_n in scales:
+        results = benchmark_scale(tickers_n, daily_days, intraday_days, repeat)
+        report["scales"].append(results)
+        logging.info(f"{tickers_n} tickers: csv load {results['load_data_csv']:.2f}s, cached load {results['load_data_cache']:.2f}s, "
+                     f"backtest {results['start_backtest']:.2f}s ({results['backtest_days']} days)")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = report["commit"] + ("-dirty" if report["dirty"] else "")
+    results_file = os.path.join(RESULTS_DIR, f"{name}.json")
+    if os.path.isfile(results_file):
+        # keep the scales of the previous runs on the same commit
+        with open(results_file) as f:
+            previous = json.load(f)
+        measured = {scale["tickers"] for scale in report["scales"]}
+        report["scales"] = [scale for scale in previous["scales"] if scale["tickers"] not in measured] + report["scales"]
+    with open(results_file, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Benchmark results saved to {results_file}")
+    return results_file
+
+
+def flatten(scale:dict) -> dict:
+    timings = {name: value for name, value in scale.items() if name in ("load_data_csv", "load_data_cache", "build_intraday_cubes", "algo_init", "start_backtest")}
+    timings.update({f"stage:{name}": stage["total_wall"] for name, stage in scale["stages"].items()})
+    return timings
+
+
+def compare(old_file:str, new_file:str, threshold:float=0.1) -> pd.DataFrame:
+    """
+    Timings of two benchmark results side by side. The rows slower by more than threshold are flagged.
+    """
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+
+    rows = []
+    for name, new_time in new.get("startup", {}).items():
+        old_time = old.get("startup", {}).get(name, np.nan)
+        rows.append({"tickers": 0, "timing": f"startup:{name}", "old": old_time, "new": new_time, "ratio": new_time / old_time})
+    for new_scale in new["scales"]:
+        old_scale = next((scale for scale in old["scales"] if scale["tickers"] == new_scale["tickers"]), None)
+        if old_scale is None:
+            continue
+        old_timings = flatten(old_scale)
+        for name, new_time in flatten(new_scale).items():
+            old_time = old_timings.get(name, np.nan)
+            rows.append({"tickers": new_scale["tickers"], "timing": name, "old": old_time, "new": new_time, "ratio": new_time / old_time})
+
+    comparison = pd.DataFrame(rows)
+    if not comparison.empty:
+        comparison["regression"] = comparison["ratio"] > 1 + threshold
+    return comparison
+
+
+def main(argv:list=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Benchmark the backtest on synthetic data")
+    parser.add_argument("--scales", type=int, nargs="+", default=[50, 500, 3000], help="numbers of tickers")
+    parser.add_argument("--daily-days", type=int, default=130)
+    parser.add_argument("--intraday-days", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=1, help="the best of repeat runs is kept for the data loading timings")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        print(compare(*args.compare).to_string(index=False))
+    else:
+        run(args.scales, args.daily_days, args.intraday_days, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
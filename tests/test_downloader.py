@@ -0,0 +1,42 @@
+from datetime import datetime
+
+import pandas as pd
+
+from backtester.config import BKTConfig
+from backtester.data.downloader import DataDownloader
+from backtester.data.store import EXCHANGE_TZ, PartitionedStore
+from backtester.data.synthetic import SyntheticProvider
+
+
+class ExchangeTimesProvider(SyntheticProvider):
+    # intraday timestamps with their UTC offset, as yfinance returns them
+    def timestamps(self, start, end, interval:str) -> pd.DatetimeIndex:
+        timestamps = super().timestamps(start, end, interval)
+        return timestamps if interval == "1d" else timestamps.tz_localize(EXCHANGE_TZ)
+
+
+def test_intraday_download_across_dst_change(tmp_path):
+    config = BKTConfig(data_dir=str(tmp_path))
+    config.download_chunk_size = 2
+    downloader = DataDownloader(config, ExchangeTimesProvider(bars_per_day=3), ["A", "B", "C"])
+    # daylight saving time ends on 2024-11-03
+    start, end = datetime(2024, 10, 31), datetime(2024, 11, 6)
+
+    data, report = downloader.download_frame("intraday_stocks", ["A", "B", "C"], start, end, "2m")
+    assert report["failed"] == 0
+    assert str(data.index.tz) == EXCHANGE_TZ
+    assert list(data.columns) == ["A", "B", "C"] and data.notna().all().all()
+
+    store = PartitionedStore(config.data_store_dir)
+    assert store.append("intraday_stocks", data, partition="day") == ["2024-10-31", "2024-11-01", "2024-11-04", "2024-11-05"]
+    stored = store.read("intraday_stocks")
+    assert stored.index.tz is None
+    assert (stored.index.strftime("%H:%M") == "09:30").sum() == 4
+
+
+def test_daily_download_keeps_dates(tmp_path):
+    config = BKTConfig(data_dir=str(tmp_path))
+    downloader = DataDownloader(config, SyntheticProvider(), ["A"])
+    data, _ = downloader.download_frame("daily_stocks", ["A"], datetime(2024, 10, 31), datetime(2024, 11, 6), "1d")
+    assert data.index.tz is None
+    assert list(data.index.strftime("%Y-%m-%d")) == ["2024-10-31", "2024-11-01", "2024-11-04", "2024-11-05"]
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from backtester.config import BKTConfig
+from backtester.data.calendar import backtest_start
+from backtester.data.universe import UniverseSelector
+
+
+def daily_prices(tz=None) -> pd.DataFrame:
+    index = pd.bdate_range("2024-01-02", "2024-03-28", name="Date", tz=tz)
+    after = index >= pd.Timestamp("2024-02-16", tz=tz)
+    # B only enters the price range after the backtest start
+    return pd.DataFrame({"A": 10.0, "B": np.where(after, 60.0, 200.0), "C": 50.0}, index=index)
+
+
+def test_price_filter_with_tz_aware_intraday_data():
+    config = BKTConfig()
+    config.universe_min_price, config.universe_max_price = 20, 100
+    start = backtest_start(pd.Timestamp("2024-02-01 09:30:00-05:00"))
+    assert start.tz is not None
+
+    assert UniverseSelector(config).select(daily_prices(), start) == ["C"]
+    assert UniverseSelector(config).select(daily_prices("America/New_York"), backtest_start(pd.Timestamp("2024-02-01 09:30:00"))) == ["C"]
+
+
+def test_single_ticker_and_sector(tmp_path):
+    config = BKTConfig(data_dir=str(tmp_path))
+    pd.DataFrame({"ticker": ["A", "B", "C"], "sector": ["Energy", "Utilities", "Energy"]}).to_csv(config.sp500_sectors_file, index=False)
+    config.universe_sectors = "Energy"
+    assert UniverseSelector(config).select(daily_prices()) == ["A", "C"]
+
+    config.universe_tickers = "C"
+    assert UniverseSelector(config).select(daily_prices()) == ["C"]
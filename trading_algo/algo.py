@@ -1,76 +1,86 @@
-from datetime import datetime
 import numpy as np
 import pandas as pd
 
 from trading_algo.parameters import AlgoParameters
 from backtester.data.manager import MarketData
 from backtester.config import BKTConfig
+from backtester.data.calendar import TradingCalendar, shift_months
+from backtester.profiling import StageProfiler
+from trading_algo.beta import RollingBetaEstimator
+from trading_algo.cache import IntradayReturnsCache
+from trading_algo.features import FeatureStore, data_fingerprint, parameters_hash
+from trading_algo.signal import IncrementalDailySignal
+from trading_algo.ledger import ResultsLedger
+from trading_algo.ranking import RankingEngine
 import trading_algo.utils as algo_utils
 
 class LongTermAnalysis: 
     def __init__(self, trading_algo:'TradingAlgo'): 
         self.trading_algo = trading_algo
-        
-    def trend_direction_analysis(self):
-        cumulative_returns = (1 + self.trading_algo.daily_returns).ewm(span=self.trading_algo.algo_params.DAILY_EWM_WINDOW).mean()
 
-        # Check if the cumulative returns are positive or negative
-        positive_rets_df = cumulative_returns.iloc[-1] > 1
-        negative_rets_df = cumulative_returns.iloc[-1] < 1
+        # trend score, ewm std and VaR of every ticker, computed in one pass by compute_daily_metrics
+        self.daily_metrics = pd.DataFrame()
+        self.daily_signal = IncrementalDailySignal(self.trading_algo.all_daily_returns.to_numpy(),
+                                                   self.trading_algo.algo_params.DAILY_EWM_WINDOW,
+                                                   self.trading_algo.algo_params.DAILY_STD_EWM_SPAN)
+
+    def compute_daily_metrics(self):
+        params = self.trading_algo.algo_params
+        if not params.INCREMENTAL_DAILY_SIGNAL:
+            self.daily_metrics = algo_utils.daily_risk_metrics(self.trading_algo.daily_returns, params.DAILY_EWM_WINDOW, params.DAILY_STD_EWM_SPAN)
+            return
+
+        # only the daily bars added since the previous day are consumed
+        window = self.trading_algo.daily_window
+        trend, ewm_std = self.daily_signal.update(window.start + 1, window.stop)
+        self.daily_metrics = pd.DataFrame({"trend": trend, 
+                                           "ewm_std": ewm_std, 
+                                           "var": algo_utils.daily_var(self.trading_algo.daily_returns.to_numpy())}, 
+                                          index=self.trading_algo.daily_returns.columns)
 
-        # Sorted list of companies with positive and negative trends
-        positive_rets_list = positive_rets_df[positive_rets_df].index.to_list()
-        negative_rets_list = negative_rets_df[negative_rets_df].index.to_list()
+    def trend_direction_analysis(self):
+        trend = self.daily_metrics["trend"]
 
         # sort the stocks according to the value of their cumulative returns
-        self.trading_algo.stocks_pos_trend = (cumulative_returns[positive_rets_list].iloc[-1].sort_values(ascending=False).index.to_list())
-        self.trading_algo.stocks_neg_trend = (cumulative_returns[negative_rets_list].iloc[-1].sort_values(ascending=True).index.to_list())
+        self.trading_algo.stocks_pos_trend = trend[trend > 1].sort_values(ascending=False).index.to_list()
+        self.trading_algo.stocks_neg_trend = trend[trend < 1].sort_values(ascending=True).index.to_list()
 
     def trend_stability_analysis(self):
-        daily_returns_positive = self.trading_algo.daily_returns[self.trading_algo.stocks_pos_trend]
-        daily_returns_negative = self.trading_algo.daily_returns[self.trading_algo.stocks_neg_trend]
-        long_period_ewm_std_p = daily_returns_positive.ewm(span=10, min_periods=10).std() # TOOD ewm values as parameters
-        long_period_ewm_std_n = daily_returns_negative.ewm(span=10, min_periods=10).std()
+        ewm_std = self.daily_metrics["ewm_std"]
 
-        mean_long_std_p = long_period_ewm_std_p.mean()
-        mean_long_std_n = long_period_ewm_std_n.mean()
+        self.trading_algo.pos_stocks_stable = ewm_std[self.trading_algo.stocks_pos_trend].sort_values().dropna().index.to_list()
+        self.trading_algo.neg_stocks_stable = ewm_std[self.trading_algo.stocks_neg_trend].sort_values().dropna().index.to_list()
 
-        self.trading_algo.pos_stocks_stable = mean_long_std_p.sort_values().dropna().index.to_list()
-        self.trading_algo.neg_stocks_stable = mean_long_std_n.sort_values().dropna().index.to_list()
-
-        
     def daily_var_analysis(self):
-        
-        # Calculate daily VaR for each stock with positive trend
-        pos_var_stocks = {}
-        self.daily_var_for_stocks(pos_var_stocks, self.trading_algo.stocks_pos_trend)
-
-        # Calculate daily VaR for each stock with negative trend
-        neg_var_stocks = {}
-        self.daily_var_for_stocks(neg_var_stocks, self.trading_algo.stocks_neg_trend)
-
-        sorted_positive_companies = sorted(pos_var_stocks.items(), key=lambda x: x[1], reverse=True)
-        sorted_negative_companies = sorted(neg_var_stocks.items(), key=lambda x: x[1], reverse=True)
+        var = self.daily_metrics["var"]
 
         # ordered by safest companies
-        self.trading_algo.pos_stock_best_var = list(dict(sorted_positive_companies).keys())
-        self.trading_algo.neg_stock_best_var = list(dict(sorted_negative_companies).keys())
+        self.trading_algo.pos_stock_best_var = var[self.trading_algo.stocks_pos_trend].sort_values(ascending=False, kind="stable").index.to_list()
+        self.trading_algo.neg_stock_best_var = var[self.trading_algo.stocks_neg_trend].sort_values(ascending=False, kind="stable").index.to_list()
+
+    # outputs of the analysis, attributes of the algo
+    FEATURE_LISTS = ["stocks_pos_trend", "stocks_neg_trend", "pos_stocks_stable", "neg_stocks_stable", "pos_stock_best_var", "neg_stock_best_var"]
 
+    def get_features(self, store:FeatureStore) -> dict:
+        features = {name: store.encode(getattr(self.trading_algo, name)) for name in self.FEATURE_LISTS}
+        features.update({f"daily_{name}": self.daily_metrics[name].to_numpy() for name in self.daily_metrics.columns})
+        return features
 
-    def daily_var_for_stocks(self, stocks_vars:dict, stocks):
-        for stock in stocks:
-            stock_daily_returns = self.trading_algo.daily_returns[stock]
-            var = algo_utils.value_at_risk(stock_daily_returns)
-            stocks_vars[stock] = var
+    def set_features(self, store:FeatureStore, features:dict):
+        for name in self.FEATURE_LISTS:
+            setattr(self.trading_algo, name, store.decode(features[name]))
+        self.daily_metrics = pd.DataFrame({name: features[f"daily_{name}"] for name in ("trend", "ewm_std", "var")},
+                                          index=self.trading_algo.daily_returns.columns)
 
     def perform_analysis(self): 
+        self.compute_daily_metrics()
         self.trend_direction_analysis()
         self.trend_stability_analysis()
         self.daily_var_analysis()
     
-    def aggregate_daily_analysis(self):
-        self.best_positive_daily = algo_utils.rank_lists([self.trading_algo.stocks_pos_trend,self.trading_algo.pos_stocks_stable,self.trading_algo.pos_stock_best_var], self.trading_algo.stocks_ranking_dictionary)
-        self.best_negative_daily = algo_utils.rank_lists([self.trading_algo.stocks_neg_trend,self.trading_algo.neg_stocks_stable,self.trading_algo.neg_stock_best_var], self.trading_algo.stocks_ranking_dictionary)
+    def aggregate_daily_analysis(self, ranking:RankingEngine):
+        self.best_positive_daily = ranking.rank([self.trading_algo.stocks_pos_trend,self.trading_algo.pos_stocks_stable,self.trading_algo.pos_stock_best_var])
+        self.best_negative_daily = ranking.rank([self.trading_algo.stocks_neg_trend,self.trading_algo.neg_stocks_stable,self.trading_algo.neg_stock_best_var])
 
 
 class ShortTermAnalysis: 
@@ -78,6 +88,8 @@ class ShortTermAnalysis:
         self.trading_algo = trading_algo
 
         self.stocks_intraday_cumrets = pd.DataFrame()
+        self.stocks_returns_cache = IntradayReturnsCache(self.trading_algo.analysis_cube, self.trading_algo.analysis_session)
+        self.index_returns_cache = IntradayReturnsCache(self.trading_algo.analysis_index_cube, self.trading_algo.analysis_session)
         
         # Stocks' rankings for intraday analysis
         self.intraday_positive = pd.DataFrame()
@@ -87,47 +99,56 @@ class ShortTermAnalysis:
         self.intraday_var_pos = pd.DataFrame()
         self.intraday_var_neg = pd.DataFrame()
 
-    def intraday_trend_analysis(self, date):
-        def compute_returns(grouped_data):
-            cum_returns = {}
-            pct_rets = {}
-            for day, group in grouped_data:
-                intraday_data = group[pd.to_datetime("09:35:00").time() : pd.to_datetime("15:45:00").time()] #TODO start of the day should be parametrized 
-                pct_change = intraday_data.pct_change(fill_method=None).fillna(0)
-                cum_ret = ((1 + pct_change).cumprod().fillna(1)) 
-                cum_returns[day] = cum_ret
-                pct_rets[day] = pct_change
-            return cum_returns, pct_rets
-
-        def find_trend_count(cum_rets: dict[pd.DataFrame], valid_companies, sign: str):
-            cum_rets_list = [elem.iloc[-1] for elem in cum_rets.values()]
-            cumprod_group = pd.concat(cum_rets_list, axis=1).T
+        # betas of every ticker of the intraday cube over the window
+        self.beta_estimator = RollingBetaEstimator()
+        self.betas = np.array([])
+
+    # outputs of the analysis: ticker lists and ewm series (also carried to the next day)
+    FEATURE_LISTS = ["intraday_positive", "intraday_negative"]
+    FEATURE_SERIES = ["intraday_max_dd_pos", "intraday_max_dd_neg", "intraday_var_pos", "intraday_var_neg"]
+
+    def get_features(self, store:FeatureStore) -> dict:
+        features = {name: store.encode(getattr(self, name)) for name in self.FEATURE_LISTS}
+        for name in self.FEATURE_SERIES:
+            series = getattr(self, name)
+            features[f"{name}_tickers"] = store.encode(series.index)
+            features[f"{name}_values"] = series.to_numpy()
+        features["betas"] = self.betas
+        return features
+
+    def set_features(self, store:FeatureStore, features:dict, day_pos:int):
+        for name in self.FEATURE_LISTS:
+            setattr(self, name, store.decode(features[name]))
+        # the ewm series are named after the last day of the window
+        day = self.stocks_returns_cache.days[day_pos]
+        for name in self.FEATURE_SERIES:
+            setattr(self, name, pd.Series(features[f"{name}_values"], index=store.decode(features[f"{name}_tickers"]), name=day))
+        self.betas = features["betas"]
+
+    def intraday_trend_analysis(self, day_pos:int):
+        def find_trend_count(cum_rets:np.ndarray, valid_companies, sign: str):
+            # cum_rets is days x bars x tickers, the trend of each day is the cumulative return of its last bar
+            last_cum_rets = cum_rets[:, -1, self.trading_algo.intraday_cube.columns(valid_companies)]
             if sign == "positive":
-                cumprod_group = cumprod_group[valid_companies]
-                trend_count = cumprod_group[cumprod_group[:] > 1]
+                trend_count = (last_cum_rets > 1).sum(axis=0)
             else:
-                cumprod_group = cumprod_group[valid_companies]
-                trend_count = cumprod_group[cumprod_group[:] < 1]
+                trend_count = (last_cum_rets < 1).sum(axis=0)
 
-            return trend_count.count()
+            return pd.Series(trend_count, index=valid_companies)
 
 
-        intraday_stocks = self.trading_algo.intraday_stocks.loc[self.trading_algo.start_date_intraday : date, :]
-        intraday_index = self.trading_algo.intraday_index.loc[self.trading_algo.start_date_intraday : date, :]
+        # Returns are cached per day: only the days entering the window are computed
+        first_pos = self.trading_algo.calendar.intraday_start(self.trading_algo.start_date_intraday)
+        self.index_indtraday_cumrets = self.index_returns_cache.update(first_pos, day_pos)[0]
+        self.stocks_intraday_cumrets, self.stocks_intraday_rets = self.stocks_returns_cache.update(first_pos, day_pos)
+        self.window_cumrets = np.stack(list(self.stocks_intraday_cumrets.values()))
+        self.window_rets = np.stack(list(self.stocks_intraday_rets.values()))
 
-        grouped_stocks = intraday_stocks.groupby(intraday_stocks.index.date)
-        grouped_index = intraday_index.groupby(intraday_index.index.date)
+        valid_positive_intraday = [stock for stock in self.trading_algo.intraday_cube.tickers if stock in self.trading_algo.stocks_pos_trend]
+        valid_negative_intraday = [stock for stock in self.trading_algo.intraday_cube.tickers if stock in self.trading_algo.stocks_neg_trend]
 
-        self.index_indtraday_cumrets = compute_returns(grouped_index)[0]
-        stock_returns = compute_returns(grouped_stocks)
-        self.stocks_intraday_cumrets = stock_returns[0]
-        self.stocks_intraday_rets = stock_returns[1]
-        valid_positive_intraday = [stock for stock in list(self.stocks_intraday_cumrets.values())[0].columns if stock in self.trading_algo.stocks_pos_trend]
-        valid_negative_intraday = [stock for stock in list(self.stocks_intraday_cumrets.values())[0].columns if stock in self.trading_algo.stocks_neg_trend]
-
-        # index_intraday_rets = compute_returns(grouped_index)
-        trend_count_positive = find_trend_count(self.stocks_intraday_cumrets, valid_positive_intraday, "positive").sort_values(ascending=False)
-        trend_count_negative = find_trend_count(self.stocks_intraday_cumrets, valid_negative_intraday, "negative").sort_values(ascending=False)
+        trend_count_positive = find_trend_count(self.window_cumrets, valid_positive_intraday, "positive").sort_values(ascending=False)
+        trend_count_negative = find_trend_count(self.window_cumrets, valid_negative_intraday, "negative").sort_values(ascending=False)
 
         # stocks are ranked on the basis of how many days the intraday trend followed the multi-day trend
         self.intraday_positive = trend_count_positive.index.to_list()
@@ -135,22 +156,23 @@ class ShortTermAnalysis:
 
     def intraday_stability_analysis(self):
         # drawdown, rsi, VaR
+        days = list(self.stocks_intraday_cumrets.keys())
+        positive_columns = self.trading_algo.intraday_cube.columns(self.intraday_positive)
+        negative_columns = self.trading_algo.intraday_cube.columns(self.intraday_negative)
 
-        for day, df in self.stocks_intraday_cumrets.items():
-
-            # drawdown
-            self.intraday_max_dd_pos = algo_utils.intraday_max_drawdown(self.intraday_max_dd_pos, df, self.intraday_positive)
-            self.intraday_max_dd_neg = algo_utils.intraday_max_drawdown(self.intraday_max_dd_neg, df, self.intraday_negative)
+        # drawdown
+        self.intraday_max_dd_pos = algo_utils.intraday_max_drawdown(self.intraday_max_dd_pos, self.window_cumrets[:, :, positive_columns], days, self.intraday_positive)
+        self.intraday_max_dd_neg = algo_utils.intraday_max_drawdown(self.intraday_max_dd_neg, self.window_cumrets[:, :, negative_columns], days, self.intraday_negative)
 
-            # var
-            self.intraday_var_pos = algo_utils.intraday_var(day, self.intraday_var_pos, self.stocks_intraday_rets, self.intraday_positive)
-            self.intraday_var_neg = algo_utils.intraday_var(day, self.intraday_var_neg, self.stocks_intraday_rets, self.intraday_negative, negative_returns=True)
-       
+        # var
+        self.intraday_var_pos = algo_utils.intraday_var(self.intraday_var_pos, self.window_rets[:, :, positive_columns], days, self.intraday_positive)
+        self.intraday_var_neg = algo_utils.intraday_var(self.intraday_var_neg, self.window_rets[:, :, negative_columns], days, self.intraday_negative, negative_returns=True)
         
-        self.intraday_max_dd_neg = (self.intraday_max_dd_neg.T.ewm(span=5, min_periods=1).mean().iloc[-1]) # TODO ewm 1 week -> parametrize
-        self.intraday_max_dd_pos = (self.intraday_max_dd_pos.T.ewm(span=5, min_periods=1).mean().iloc[-1])
-        self.intraday_var_pos = (self.intraday_var_pos.T.ewm(span=5, min_periods=1).mean().iloc[-1])
-        self.intraday_var_neg = (self.intraday_var_neg.T.ewm(span=5, min_periods=1).mean().iloc[-1])
+        span = self.trading_algo.algo_params.INTRADAY_EWM_SPAN
+        self.intraday_max_dd_neg = (self.intraday_max_dd_neg.T.ewm(span=span, min_periods=1).mean().iloc[-1])
+        self.intraday_max_dd_pos = (self.intraday_max_dd_pos.T.ewm(span=span, min_periods=1).mean().iloc[-1])
+        self.intraday_var_pos = (self.intraday_var_pos.T.ewm(span=span, min_periods=1).mean().iloc[-1])
+        self.intraday_var_neg = (self.intraday_var_neg.T.ewm(span=span, min_periods=1).mean().iloc[-1])
 
         self.intraday_max_dd_neg = self.intraday_max_dd_neg.sort_values(ascending=False)
         self.intraday_max_dd_pos = self.intraday_max_dd_pos.sort_values(ascending=False)
@@ -158,35 +180,62 @@ class ShortTermAnalysis:
         self.intraday_var_neg = self.intraday_var_neg.sort_values(ascending=False)  
     
     
-    def perform_analysis(self, date): 
-        self.intraday_trend_analysis(date)
+    def intraday_beta_analysis(self):
+        # running sums of the intraday window, only the days entering or leaving it are processed
+        self.beta_estimator.update(self.stocks_intraday_cumrets, self.index_indtraday_cumrets)
+        self.betas = self.beta_estimator.betas(slice(None))
+
+    def perform_analysis(self, day_pos:int): 
+        self.intraday_trend_analysis(day_pos)
         self.intraday_stability_analysis()
+        self.intraday_beta_analysis()
 
-    def aggregate_intraday_analysis(self): 
-        self.best_positive_intraday = algo_utils.rank_lists([self.intraday_positive,self.intraday_max_dd_pos.index,self.intraday_var_pos.index,], self.trading_algo.stocks_ranking_dictionary)
-        self.best_negative_intraday = algo_utils.rank_lists([self.intraday_negative,self.intraday_max_dd_neg.index,self.intraday_var_neg.index,], self.trading_algo.stocks_ranking_dictionary)
+    def aggregate_intraday_analysis(self, ranking:RankingEngine): 
+        self.best_positive_intraday = ranking.rank([self.intraday_positive,self.intraday_max_dd_pos.index,self.intraday_var_pos.index,])
+        self.best_negative_intraday = ranking.rank([self.intraday_negative,self.intraday_max_dd_neg.index,self.intraday_var_neg.index,])
 
 class TradingAlgo: 
-    def __init__(self, bkt_config:BKTConfig, market_data:MarketData) -> None:
+    def __init__(self, bkt_config:BKTConfig, market_data:MarketData, algo_params:AlgoParameters=None) -> None:
         self.bkt_config = bkt_config
-        self.long_term_analysis = LongTermAnalysis(self)
-        self.short_term_analysis = ShortTermAnalysis(self)
-        
-        self.algo_params = AlgoParameters()
+        self.algo_params = algo_params if algo_params is not None else AlgoParameters()
 
         # Initialize data
         self.daily_stocks = market_data.daily_stocks
         self.intraday_stocks = market_data.intraday_stocks
         self.daily_index = market_data.daily_index
         self.intraday_index = market_data.intraday_index
+        # the cubes traded and the cubes analysed, each on its own bar size (same days and tickers)
+        self.intraday_cube, self.intraday_index_cube = market_data.resampled_cubes(self.algo_params.EXECUTION_BAR_MINUTES)
+        self.analysis_cube, self.analysis_index_cube = market_data.resampled_cubes(self.algo_params.ANALYSIS_BAR_MINUTES)
+        # integer offsets of the trading days, the day positions are the positions in the intraday cubes
+        self.calendar = TradingCalendar(self.daily_stocks.index, self.intraday_cube.days)
+        self.session = self.intraday_cube.session_slice(self.algo_params.SESSION_START, self.algo_params.SESSION_END)
+        self.analysis_session = self.analysis_cube.session_slice(self.algo_params.SESSION_START, self.algo_params.SESSION_END)
+        self.session_start = pd.Timedelta(self.algo_params.SESSION_START)
+        self.session_end = pd.Timedelta(self.algo_params.SESSION_END)
+
+        self.all_daily_returns = self.daily_stocks.pct_change(fill_method=None)
+
+        self.long_term_analysis = LongTermAnalysis(self)
+        self.short_term_analysis = ShortTermAnalysis(self)
+
+        # daily and intraday tickers, each once: the positions of the rankings and of the feature store
+        self.tickers = list(dict.fromkeys(list(self.daily_stocks.columns) + list(self.intraday_cube.tickers)))
+
+        # Per day outputs of the analyses saved on disk, see analyse
+        self.feature_store = None
+        if self.bkt_config.feature_store:
+            self.feature_store = FeatureStore(self.bkt_config.feature_store_dir, self.bkt_config.feature_store_max_mb, self.tickers)
+        self.feature_keys = None
+        self.feature_history = ""
 
         # Useful variables 
-        self.start_date_daily = datetime.min
-        self.start_date_intraday = datetime.min
+        self.start_date_daily = np.datetime64("NaT", "D")
+        self.start_date_intraday = np.datetime64("NaT", "D")
         self.bkt_days_count = 1
-        self.daily_prt_beta_list = []        
 
         # Return variables
+        self.daily_window = slice(0, 0)
         self.daily_returns = pd.DataFrame() # TODO consider to add as attribute of LongTermAnalysis
         
         # Stock's ranking for daily analysis
@@ -200,22 +249,91 @@ class TradingAlgo:
         self.pos_stock_best_var = pd.DataFrame()
         self.neg_stock_best_var = pd.DataFrame()
 
-        self.stocks_ranking_dictionary = {}
+        # Borda scores of the rankings, reset with the daily window
+        self.ranking = RankingEngine(self.tickers)
         self.selected_stocks_with_scores = list()
+
+        # Trading results
+        self.trading_day = None
+        # optional grid of exit rules evaluated on the session path of each day, see ExitRuleGrid
+        self.exit_grid = None
+        self.profiler = StageProfiler(self.bkt_config.profile, self.bkt_config.profile_memory)
+        self.notional = self.bkt_config.notional
+        # running averages of the daily drawdowns, idx_avg_drawdown drives the intraday exits
+        self.avg_drawdown = 0
+        self.idx_avg_drawdown = 0
+        self.reset_results()
+
+    # Attributes carried from one day to the next, saved in the checkpoints
+    STATE_ATTRIBUTES = [
+        "ranking", "start_date_daily", "start_date_intraday", "bkt_days_count", "ledger", "feature_history",
+        "total_return", "total_gross_return", "total_commission", "total_perc_ret", "max_drawdown", "avg_drawdown",
+        "idx_total_return", "idx_total_gross_return", "idx_total_commission", "total_idx_perc_ret", "idx_max_drawdown", "idx_avg_drawdown",
+    ]
+    SHORT_TERM_STATE_ATTRIBUTES = ["intraday_max_dd_pos", "intraday_max_dd_neg", "intraday_var_pos", "intraday_var_neg"]
+    # AlgoParameters used by the analyses
+    FEATURE_PARAMETERS = ["DAILY_EWM_WINDOW", "DAILY_STD_EWM_SPAN", "INTRADAY_EWM_SPAN", "INCREMENTAL_DAILY_SIGNAL", "SESSION_START", "SESSION_END",
+                          "ANALYSIS_BAR_MINUTES"]
+
+    def reset_results(self):
+        """
+        Reset the P&L totals and the daily results lists. The running drawdown averages are kept,
+        so that a backtest warmed up on previous days keeps the same intraday exits.
+        """
+        self.total_return = 0
+        self.total_gross_return = 0
+        self.total_commission = 0
+        self.total_perc_ret = 0
+        self.max_drawdown = 0
+        self.idx_total_return = 0
+        self.idx_total_gross_return = 0
+        self.idx_total_commission = 0
+        self.total_idx_perc_ret = 0
+        self.idx_max_drawdown = 0
+
+        # daily and per position results, keeps the capacity reserved by the Backtester
+        days_n = len(self.ledger.days) if hasattr(self, "ledger") else 0
+        self.ledger = ResultsLedger(days_n, positions_per_day=self.bkt_config.instruments_number)
+
+    def summary(self) -> dict:
+        return {
+            "pnl": self.total_return,
+            "gross_pnl": self.total_gross_return,
+            "perc_pnl": self.total_perc_ret,
+            "commissions": self.total_commission,
+            "max_drawdown": self.max_drawdown,
+            "avg_drawdown": self.avg_drawdown,
+            "idx_pnl": self.idx_total_return,
+            **self.ledger.summary(),
+        }
+
+    def get_state(self) -> dict:
+        return {
+            "algo": {name: getattr(self, name) for name in self.STATE_ATTRIBUTES},
+            "short_term_analysis": {name: getattr(self.short_term_analysis, name) for name in self.SHORT_TERM_STATE_ATTRIBUTES},
+        }
+
+    def set_state(self, state:dict):
+        for name, value in state["algo"].items():
+            setattr(self, name, value)
+        for name, value in state["short_term_analysis"].items():
+            setattr(self.short_term_analysis, name, value)
         
     def aggregate_total_analysis(self):
-        self.best_positive = algo_utils.rank_lists([self.long_term_analysis.best_positive_daily, self.short_term_analysis.best_positive_intraday], self.stocks_ranking_dictionary)
-        self.best_negative = algo_utils.rank_lists([self.long_term_analysis.best_negative_daily, self.short_term_analysis.best_negative_intraday], self.stocks_ranking_dictionary)
-
         # The number of stocks to buy and to sell is determined on the basis 
-        # of the length of self.best_positive and self.best_negative
+        # of the number of positive and negative intraday candidates
         majority_leg = int(self.bkt_config.instruments_number / 2) + 1
         minority_leg = self.bkt_config.instruments_number - majority_leg
-        long_instr_n = (majority_leg if len(self.best_positive) > len(self.best_negative) else minority_leg)
+        long_instr_n = (majority_leg if len(self.short_term_analysis.best_positive_intraday) > len(self.short_term_analysis.best_negative_intraday) else minority_leg)
         short_instr_n = self.bkt_config.instruments_number - long_instr_n
+
+        # only the best long_instr_n and short_instr_n stocks are sorted
+        weights = [self.algo_params.DAILY_RANK_WEIGHT, self.algo_params.INTRADAY_RANK_WEIGHT]
+        self.best_positive = self.ranking.rank([self.long_term_analysis.best_positive_daily, self.short_term_analysis.best_positive_intraday], top_k=long_instr_n, weights=weights)
+        self.best_negative = self.ranking.rank([self.long_term_analysis.best_negative_daily, self.short_term_analysis.best_negative_intraday], top_k=short_instr_n, weights=weights)
         
-        instruments_list = (self.best_negative[:short_instr_n] + self.best_positive[:long_instr_n])
-        self.selected_stocks_with_scores = sorted([stock for stock in self.stocks_ranking_dictionary.items() if stock[0] in instruments_list],key=lambda x: x[1],reverse=True)
+        instruments_list = (self.best_negative + self.best_positive)
+        self.selected_stocks_with_scores = self.ranking.items(instruments_list)
 
     def create_portfolio(self):
         """
@@ -244,105 +362,88 @@ class TradingAlgo:
         self.portfolio = [stock[0] for stock in self.selected_stocks_with_scores]
         total_invested = sum([stock[1] for stock in self.selected_stocks_with_scores])
 
-        tot_intraday_stocks_returns = pd.concat(self.short_term_analysis.stocks_intraday_cumrets)
-        tot_intraday_index_returns = pd.concat(self.short_term_analysis.index_indtraday_cumrets)
-        total_intraday_cumrets = pd.concat([tot_intraday_stocks_returns[self.portfolio], tot_intraday_index_returns],axis=1)
-        total_intrday_returns = total_intraday_cumrets.pct_change(fill_method=None).fillna(0)
-
-        cov_matrix = total_intrday_returns.cov()
-
-        market_var = cov_matrix["^GSPC"]["^GSPC"]
-
-        # Step 1 compute stocks values
-        beta_values = {}
-        for ticker in total_intrday_returns.columns[:-1]:
-            cov = cov_matrix["^GSPC"][ticker]
-            beta = cov / market_var
-            beta_values[ticker] = beta
-
-        # Step 2 compute initial portfolio beta
-        portfolio_beta = 0
-        for ticker, weight, position in self.selected_stocks_with_scores:
-            weight = abs(weight) / total_invested
-            stock_beta = (beta_values[ticker] if ticker in beta_values else 0)  # Use 0 if beta is not available
-            portfolio_beta += (weight * stock_beta * position)
-
+        # the betas of every ticker are computed by the intraday analysis
+        columns = self.intraday_cube.columns(self.portfolio)
+        weights = np.array([abs(weight) / total_invested * position for _, weight, position in self.selected_stocks_with_scores])
+        portfolio_beta = float(self.short_term_analysis.betas[columns] @ weights)
 
         self.portfolio_beta = portfolio_beta
-        self.daily_prt_beta_list.append(self.portfolio_beta) # compute the avg portfolio beta in the stats processing
 
-    def reset_daily_ranking(self, date): 
-        trading_day = datetime.strptime(date, "%Y-%m-%d")
-        trading_day = np.datetime64(trading_day, 'D')
-        start_date_daily = np.datetime64(self.start_date_daily, 'D')
-        business_days = np.busday_count(start_date_daily, trading_day)
+    def reset_daily_ranking(self, day_pos:int): 
+        business_days = np.busday_count(self.start_date_daily, self.calendar.days[day_pos])
         if business_days >= 132: # TODO 6 months -> parametrize
             return True
         else:
             return False 
 
-    def reset_intraday_ranking(self, date): 
-        trading_day = datetime.strptime(date, "%Y-%m-%d")
-        trading_day = np.datetime64(trading_day, 'D')
-        start_date_intraday = np.datetime64(self.start_date_intraday, 'D')
-        business_days = np.busday_count(start_date_intraday, trading_day)
+    def reset_intraday_ranking(self, day_pos:int): 
+        business_days = np.busday_count(self.start_date_intraday, self.calendar.days[day_pos])
         if business_days >= 44: # TODO 2 month -> parametrize
             return True
         else:
             return False
 
-    def start_trading(self, date): 
-        backtest_day_stocks_data = self.intraday_stocks.loc[date, self.portfolio]
-        backtest_day_index_data = self.intraday_index.loc[date]
-        backtest_day_data = pd.concat([backtest_day_stocks_data, backtest_day_index_data], axis=1)
-        backtest_day_data = backtest_day_data[pd.to_datetime("09:35:00").time() : pd.to_datetime("15:45:00").time()] # TODO these should be parametrized
-
-        pct_returns = backtest_day_data.pct_change(fill_method=None).fillna(0)
-        pct_cumret = (pct_returns + 1).cumprod() - 1
-        
-        end_of_day_notional = pd.DataFrame()
-        for instrument in self.portfolio + ["^GSPC"]:
-            for spec in self.selected_stocks_with_scores:
-                if instrument in spec:
-                    size = spec[1]
-                    pos_sign = spec[2]
-            end_of_day_notional = pd.concat([end_of_day_notional,pd.DataFrame(((pct_cumret[instrument] * size * pos_sign) + size))],axis=1)
-
-        idx_cumret = pct_cumret["^GSPC"]
+    def index_session(self, day_pos:int):
+        """
+        Index prices of the day, with the cumulative returns and the notional of the index benchmark held for the whole session.
+        """
+        index_prices = self.intraday_index_cube.values[day_pos, :, 0]
+        idx_cumret = algo_utils.cumulative_returns(index_prices[self.session])
         idx_end_of_day_notional = idx_cumret * self.bkt_config.notional + self.bkt_config.notional
-        if self.algo_params.INCLUDE_INDEX == False: 
-            end_of_day_notional = end_of_day_notional.drop(columns=["^GSPC"])
+        return index_prices, idx_cumret, idx_end_of_day_notional
 
-        end_of_day_notional = self.intraday_position_management(end_of_day_notional)
+    def seed_index_drawdowns(self, positions):
+        """
+        Running average of the index drawdowns (which drives the intraday exits) over the days at positions, as if they
+        had been traded: it only depends on the index prices, so a backtest started later keeps the same exits.
+        """
+        for day_pos in positions:
+            idx_max_drawdown = algo_utils.max_drawdown(self.index_session(day_pos)[2])
+            self.idx_avg_drawdown += (idx_max_drawdown - self.idx_avg_drawdown) / self.bkt_days_count
+            self.bkt_days_count += 1
+
+    def start_trading(self, day_pos:int, bars=None): 
+        """
+        Trade the portfolio for the day. Without bars the whole session is simulated at once from the intraday cube,
+        otherwise bars yields the (timestamp, stocks prices, index price) of each bar of the day, see Backtester.intraday_bars.
+        """
+        index_prices, idx_cumret, idx_end_of_day_notional = self.index_session(day_pos)
+
+        sizes = np.array([spec[1] for spec in self.selected_stocks_with_scores], dtype=float)
+        signed_sizes = sizes * np.array([spec[2] for spec in self.selected_stocks_with_scores])
+        if self.algo_params.INCLUDE_INDEX: 
+            # the index leg takes the size and the side of the last instrument
+            sizes = np.append(sizes, sizes[-1])
+            signed_sizes = np.append(signed_sizes, signed_sizes[-1])
+
+        if bars is None:
+            positions_notional, prt_notional, first_prices, exit_bar = self.batch_execution(day_pos, idx_cumret, sizes, signed_sizes)
+        else:
+            positions_notional, prt_notional, first_prices, exit_bar = self.streaming_execution(bars, sizes, signed_sizes)
 
-        prt_commissions = self.compute_commissions(date,end_of_day_notional)
-        idx_commissions = self.compute_commissions(date,idx_end_of_day_notional,is_index=True)
         # compute commissions for the day  
-        prt_daily_commission = prt_commissions[0]
-        idx_daily_commission = idx_commissions[0]
+        prt_daily_commission, positions_commissions = self.compute_commissions(positions_notional[0], first_prices)
 
-        # produce the list of trades of the day 
-        self.produce_list_of_trades_v2(end_of_day_notional, prt_commissions[1])        
+        if self.exit_grid is not None:
+            self.exit_grid.add_day(prt_notional, self.idx_avg_drawdown, prt_daily_commission)
+        positions_notional = positions_notional[: exit_bar + 1]
+        prt_notional = prt_notional[: exit_bar + 1]
+        idx_daily_commission = self.compute_commissions(idx_end_of_day_notional[:1], index_prices[:1])[0]
 
-        intraday_prt_vol = end_of_day_notional["prt"].std() / self.bkt_config.notional
-        self.prt_intraday_volas.append(intraday_prt_vol)
+        # produce the list of trades of the day 
+        self.produce_list_of_trades_v2(positions_notional, positions_commissions)        
 
-        intraday_idx_vol = idx_end_of_day_notional.std() / self.bkt_config.notional
-        self.idx_intraday_volas.append(intraday_idx_vol)
+        intraday_prt_vol = algo_utils.sample_std(prt_notional) / self.bkt_config.notional
+        intraday_idx_vol = algo_utils.sample_std(idx_end_of_day_notional) / self.bkt_config.notional
  
 
-        prt_trad_ret_gross = (end_of_day_notional["prt"].iloc[-1] - end_of_day_notional["prt"].iloc[0])
+        prt_trad_ret_gross = (prt_notional[-1] - prt_notional[0])
 
         prt_trad_ret = (prt_trad_ret_gross) - prt_daily_commission
-        self.list_idx_ret.append(prt_trad_ret)
 
-        prt_perc_ret = (prt_trad_ret / end_of_day_notional["prt"].iloc[0])
+        prt_perc_ret = (prt_trad_ret / prt_notional[0])
 
-        prt_drawdown = (
-            end_of_day_notional["prt"] / end_of_day_notional["prt"].cummax() - 1
-        )
-
-        prt_max_drawdown = abs(prt_drawdown.min())
+        prt_max_drawdown = algo_utils.max_drawdown(prt_notional)
 
         self.total_commission += prt_daily_commission
 
@@ -350,7 +451,7 @@ class TradingAlgo:
         # comparison with index : 
 
         idx_trad_ret_gross = (
-            idx_end_of_day_notional.iloc[-1] - idx_end_of_day_notional.iloc[0]
+            idx_end_of_day_notional[-1] - idx_end_of_day_notional[0]
         ) 
 
         # idx_spread_costs = idx_end_of_day_notional.iloc[0]*0.0004
@@ -359,12 +460,9 @@ class TradingAlgo:
         idx_trad_ret = (idx_trad_ret_gross) - idx_daily_commission
 
         idx_perc_ret = (
-            (idx_trad_ret / idx_end_of_day_notional.iloc[0]) 
-        )
-        idx_drawdown = (
-            idx_end_of_day_notional / idx_end_of_day_notional.cummax() - 1
+            (idx_trad_ret / idx_end_of_day_notional[0]) 
         )
-        idx_max_drawdown = abs(idx_drawdown.min())
+        idx_max_drawdown = algo_utils.max_drawdown(idx_end_of_day_notional)
 
         # self.total_idx_spread += idx_spread_costs 
         # self.total_idx_commission += idx_commission_costs
@@ -373,12 +471,11 @@ class TradingAlgo:
 
         # self.idx_average_invested += (
         #     self.global_sorted[-1][1] - self.idx_average_invested
-        # ) / self.days_count
+        # ) / self.bkt_days_count
         
 
         # print(f"Stats for trading day: {self.trading_day}")
         # print(self.global_sorted)
-        self.operative_sets_list.append(self.portfolio)
         # if "idx" in [instr[0] for instr in self.global_sorted]:
         #     print("index in operative set!")
         #     time.sleep(2)
@@ -415,11 +512,11 @@ class TradingAlgo:
             else self.idx_max_drawdown
         )
 
-        # self.avg_drawdown += (self.max_drawdown - self.avg_drawdown) / self.days_count
-        # self.idx_avg_drawdown += (self.idx_max_drawdown - self.idx_avg_drawdown) / self.days_count
+        # self.avg_drawdown += (self.max_drawdown - self.avg_drawdown) / self.bkt_days_count
+        # self.idx_avg_drawdown += (self.idx_max_drawdown - self.idx_avg_drawdown) / self.bkt_days_count
 
-        self.avg_drawdown += (prt_max_drawdown - self.avg_drawdown) / self.days_count
-        self.idx_avg_drawdown += (idx_max_drawdown - self.idx_avg_drawdown) / self.days_count
+        self.avg_drawdown += (prt_max_drawdown - self.avg_drawdown) / self.bkt_days_count
+        self.idx_avg_drawdown += (idx_max_drawdown - self.idx_avg_drawdown) / self.bkt_days_count
 
         # print(f"Total Portfolio P&L: {round(self.total_return,2)} $")
         # print(f"Total Portfolio %P&L: {round(total_perc_ret*100, 3)} %")
@@ -427,10 +524,6 @@ class TradingAlgo:
         # print(f"Total prt Max Drawdown: {round(self.max_drawdown*100, 3)} %")
         # print(f"Avg prt Max Drawdown: {round(self.avg_drawdown*100, 3)} %")
         # print(f"Avg portfolio Beta: {round(self.avg_portfolio_beta, 3)}")
-        self.avg_drawdown_list.append(self.avg_drawdown)
-        self.avg_idx_drawdown_list.append(self.idx_avg_drawdown)
-        self.max_drawdown_list.append(self.max_drawdown)
-        self.max_idx_drawdown_list.append(self.idx_max_drawdown)
 
         #     print("self.avg_drawdown_list")
         #     print(self.avg_drawdown_list)
@@ -472,88 +565,243 @@ class TradingAlgo:
         # ic(self.idx_avg_drawdown)
 
 
-        this_day_prt_return = pd.DataFrame.from_dict({"date" : self.trading_day, "ret":prt_perc_ret}, orient="index")
-        self.daily_prt_returns_list = pd.concat([self.daily_prt_returns_list, this_day_prt_return], axis=1)
+        self.ledger.add_day(
+            date=self.trading_day,
+            prt_ret=prt_perc_ret, prt_pnl=prt_trad_ret, prt_gross_pnl=prt_trad_ret_gross, prt_commission=prt_daily_commission,
+            prt_vol=intraday_prt_vol, prt_max_drawdown=prt_max_drawdown,
+            idx_ret=idx_perc_ret, idx_pnl=idx_trad_ret, idx_gross_pnl=idx_trad_ret_gross, idx_commission=idx_daily_commission,
+            idx_vol=intraday_idx_vol, idx_max_drawdown=idx_max_drawdown,
+            beta=self.portfolio_beta,
+            avg_drawdown=self.avg_drawdown, idx_avg_drawdown=self.idx_avg_drawdown,
+            max_drawdown=self.max_drawdown, idx_total_max_drawdown=self.idx_max_drawdown,
+        )
+
+        self.bkt_days_count += 1
+
+    def batch_execution(self, day_pos:int, idx_cumret:np.ndarray, sizes:np.ndarray, signed_sizes:np.ndarray):
+        """
+        Notional of each position and of the portfolio along the whole session, the first prices of the day and the exit bar.
+        """
+        stocks_prices = self.intraday_cube.values[day_pos][:, self.intraday_cube.columns(self.portfolio)]
+
+        # cumulative returns of the session, bars x instruments
+        stocks_cumret = algo_utils.cumulative_returns(stocks_prices[self.session])
+        first_prices = stocks_prices[0]
+        if self.algo_params.INCLUDE_INDEX: 
+            stocks_cumret = np.column_stack([stocks_cumret, idx_cumret])
+            first_prices = np.append(first_prices, self.intraday_index_cube.values[day_pos, 0, 0])
+
+        # notional of each position and of the whole portfolio along the day
+        positions_notional = sizes + stocks_cumret * signed_sizes
+        prt_notional = sizes.sum() + stocks_cumret @ signed_sizes
+
+        exit_bar = self.intraday_position_management(prt_notional)
+        return positions_notional, prt_notional, first_prices, exit_bar
+
+    def streaming_execution(self, bars, sizes:np.ndarray, signed_sizes:np.ndarray):
+        """
+        Same as batch_execution, but the bars are consumed one at a time and the exit rules are checked on every bar:
+        the generator is closed as soon as the portfolio is closed.
+        """
+        columns = self.intraday_cube.columns(self.portfolio)
+        first_prices = previous_prices = growth = None
+        positions_path, prt_path = [], []
+        prt_peak = -np.inf
+
+        for timestamp, stocks_prices, index_price in bars:
+            prices = stocks_prices[columns]
+            if self.algo_params.INCLUDE_INDEX:
+                prices = np.append(prices, index_price)
+            if first_prices is None:
+                first_prices = prices
+
+            bar_time = timestamp - timestamp.normalize()
+            if bar_time < self.session_start:
+                continue
+            if bar_time > self.session_end:
+                break
+
+            if growth is None:
+                growth = np.ones(len(prices))
+            else:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    pct_change = prices / previous_prices - 1
+                pct_change[np.isnan(pct_change)] = 0
+                growth = growth * (1 + pct_change)
+            previous_prices = prices
 
-        this_day_idx_return = pd.DataFrame.from_dict({"date" : self.trading_day, "ret":idx_perc_ret}, orient="index")
-        self.daily_idx_returns_list = pd.concat([self.daily_idx_returns_list, this_day_idx_return], axis=1)
+            cumret = growth - 1
+            prt_notional = sizes.sum() + cumret @ signed_sizes
+            positions_path.append(sizes + cumret * signed_sizes)
+            prt_path.append(prt_notional)
 
-    def compute_commissions(self,date, portfolio_data:pd.DataFrame, is_index=False):
-        if not is_index:
-            instruments = portfolio_data.columns.to_list()[:-1]
-            prices = self.intraday_stocks.loc[date, instruments].iloc[0,:]
-            shares_n = np.ceil((portfolio_data.iloc[0,:-1].divide(prices)))
+            prt_peak = max(prt_peak, prt_notional)
+            if self.exit_signal(prt_notional, prt_peak, prt_path[0]):
+                break
+        bars.close()
 
-        else:  
-            prices = self.intraday_index.loc[date].iloc[0]
-            shares_n = np.ceil((portfolio_data.iloc[0]/ prices))
+        return np.array(positions_path), np.array(prt_path), first_prices, len(prt_path) - 1
 
+    def exit_signal(self, prt_notional:float, prt_peak:float, starting_notional:float) -> bool: 
+        """
+        Exit rules of intraday_position_management for a single bar.
+        """
+        drawdown = abs(prt_notional / prt_peak - 1)
+        if self.idx_avg_drawdown != 0.0 and drawdown > 0.0 and drawdown >= self.algo_params.DRAWDOWN_MULTIPLIER*abs(self.idx_avg_drawdown):
+            return True
+        perc_cumret = (prt_notional / starting_notional) - 1
+        return perc_cumret >= self.algo_params.TAKE_PROFIT or perc_cumret <= self.algo_params.STOP_LOSS
 
+    def produce_list_of_trades_v2(self, positions_notional:np.ndarray, commissions:np.ndarray):
+        """
+        One trade per instrument of the day: entry and exit notional and the commission paid.
+        """
+        tickers, sizes, positions = zip(*self.selected_stocks_with_scores)
+        instruments_n = len(tickers)
+        self.ledger.add_positions(
+            self.trading_day, list(tickers), sizes, positions,
+            positions_notional[0, :instruments_n], positions_notional[-1, :instruments_n], commissions[:instruments_n],
+        )
+
+    def compute_commissions(self, notional:np.ndarray, prices:np.ndarray):
+        """
+        Commissions of the positions opened with the given notional at the first price of the day.
+        """
         COMMISSION_PER_TRADE = 0.02
         TRADES_PER_SHARE = 2
+        shares_n = np.ceil(notional / prices)
         daily_commission = (shares_n * COMMISSION_PER_TRADE*TRADES_PER_SHARE)
         
         return daily_commission.sum(), daily_commission 
 
 
-    def intraday_position_management(self, notional_invested:pd.DataFrame, is_index_only=False): 
-        '''
-        '''
-        notional_invested["prt"] = notional_invested.sum(axis=1)
-
-        drawdown = notional_invested["prt"] / notional_invested["prt"].cummax() - 1
-        drawdown_filter = drawdown[(abs(drawdown) >= 0.6*abs(self.idx_avg_drawdown)) & (abs(drawdown) > 0.0)]
+    def intraday_position_management(self, prt_notional:np.ndarray) -> int: 
+        """
+        Bar at which the portfolio is closed: the first bar where the drawdown reaches DRAWDOWN_MULTIPLIER times the average 
+        index drawdown, or where the portfolio return reaches TAKE_PROFIT or STOP_LOSS, otherwise the last bar of the session.
+        """
+        exit_bar = len(prt_notional) - 1
 
-        if self.idx_avg_drawdown != 0.0 and not drawdown_filter.empty:
-            notional_invested = notional_invested.loc[:drawdown_filter.index[0]]
+        drawdown = np.abs(prt_notional / np.maximum.accumulate(prt_notional) - 1)
+        drawdown_hits = np.flatnonzero((drawdown >= self.algo_params.DRAWDOWN_MULTIPLIER*abs(self.idx_avg_drawdown)) & (drawdown > 0.0))
+        if self.idx_avg_drawdown != 0.0 and drawdown_hits.size:
+            exit_bar = drawdown_hits[0]
         
-        starting_notional = notional_invested["prt"].iloc[0]
-        perc_cumret = (notional_invested["prt"] / starting_notional) - 1 
+        perc_cumret = (prt_notional[: exit_bar + 1] / prt_notional[0]) - 1 
+        target_hits = np.flatnonzero((perc_cumret >= self.algo_params.TAKE_PROFIT) | (perc_cumret <= self.algo_params.STOP_LOSS)) # XXX parametri importanti da valutare 
+        if target_hits.size:
+            exit_bar = target_hits[0]
+        return exit_bar
+
+
+    def run(self, day_pos:int, bars=None): 
+        """
+        Trading day at position day_pos of the calendar (and of the intraday cubes).
+        """
+        self.analyse(day_pos)
+        self.trade(day_pos, bars)
+
+    def feature_file(self, day_pos:int) -> str:
+        """
+        File of the features of the day in the feature store. The history key chains the days analysed before.
+        """
+        if self.feature_keys is None:
+            # computed once: the fingerprint reads the whole market data
+            data_key = data_fingerprint(self.daily_stocks.to_numpy(), self.daily_stocks.columns.to_numpy(), self.daily_stocks.index.to_numpy(),
+                                        *self.intraday_cube.fingerprint_arrays(), *self.intraday_index_cube.fingerprint_arrays(), self.calendar.days)
+            params_key = parameters_hash({name: getattr(self.algo_params, name) for name in self.FEATURE_PARAMETERS})
+            self.feature_keys = (data_key, params_key)
 
-        profits = notional_invested[perc_cumret >= 0.006] # XXX parametri importanti da valutare 
-        losses = notional_invested[perc_cumret <= -0.003]
-        filtered_notional = pd.concat([profits, losses], axis=0)
-        # filtered_notional = losses.copy()
-        if filtered_notional.empty:
-            return notional_invested
-        filtered_notional = filtered_notional.sort_index()
-        notional_invested = notional_invested.loc[:filtered_notional.index[0]]
-        return notional_invested
+        self.feature_history = self.feature_store.chain_key(self.feature_history, self.trading_day, self.start_date_daily, self.start_date_intraday)
+        return self.feature_store.feature_file(*self.feature_keys, self.trading_day, self.feature_history)
 
+    def analyse(self, day_pos:int):
+        """
+        Market features of the day (daily and intraday analyses). They do not depend on the rankings or on the
+        portfolio settings, so that variants sharing this algo's analyses only run trade, see share_analysis.
+        With the feature store the features are read from disk when this day (with the same history) was already analysed.
+        """
+        self.trading_day = self.calendar.days[day_pos]
 
-    def run(self, date): 
         # Set the start dates for daily and intraday analyses 
 
-        self.daily_returns = (self.daily_stocks.loc[self.start_date_daily: date, :].pct_change(fill_method=None))
+        # Daily returns of the window, taken from the returns computed once on the whole history:
+        # the first day of the window has no return since its previous price is outside the window
+        self.daily_window = slice(self.calendar.daily_start(self.start_date_daily), self.calendar.daily_stop[day_pos])
+        self.daily_returns = self.all_daily_returns.iloc[self.daily_window.start + 1 : self.daily_window.stop]
+
+        feature_file = None
+        if self.feature_store is not None:
+            with self.profiler.stage("feature_store"):
+                feature_file = self.feature_file(day_pos)
+                features = self.feature_store.get(feature_file)
+                if features is not None:
+                    self.long_term_analysis.set_features(self.feature_store, features)
+                    self.short_term_analysis.set_features(self.feature_store, features, day_pos)
+                    return
 
         # PRE TRADE ANALYSIS
         ## Daily analysis
-        self.long_term_analysis.perform_analysis()
-        self.long_term_analysis.aggregate_daily_analysis()
+        with self.profiler.stage("long_term_analysis"):
+            self.long_term_analysis.perform_analysis()
         
         ## Intraday analysis
-        self.short_term_analysis.perform_analysis(date)
-        self.short_term_analysis.aggregate_intraday_analysis()
+        with self.profiler.stage("short_term_analysis"):
+            self.short_term_analysis.perform_analysis(day_pos)
+
+        if feature_file is not None:
+            with self.profiler.stage("feature_store"):
+                self.feature_store.put(feature_file, {**self.long_term_analysis.get_features(self.feature_store),
+                                                      **self.short_term_analysis.get_features(self.feature_store)})
+
+    def trade(self, day_pos:int, bars=None):
+        """
+        Rankings, portfolio and trading of the day, on the features computed by analyse.
+        """
+        self.trading_day = self.calendar.days[day_pos]
 
         ## Total analysis
-        self.aggregate_total_analysis()
+        with self.profiler.stage("aggregate_total_analysis"):
+            self.long_term_analysis.aggregate_daily_analysis(self.ranking)
+            self.short_term_analysis.aggregate_intraday_analysis(self.ranking)
+            self.aggregate_total_analysis()
 
         ## Portfolio construction 
-        self.create_portfolio()
-        self.compute_portfolio_beta()
+        with self.profiler.stage("portfolio_beta"):
+            self.create_portfolio()
+            self.compute_portfolio_beta()
 
         # START_TRADING
-        self.start_trading(date)
+        with self.profiler.stage("start_trading"):
+            self.start_trading(day_pos, bars)
 
-        # Check if the ranking dictionary needs to be reset
-        if self.reset_daily_ranking(date): 
-            self.stocks_ranking_dictionary = {}
+        self.update_start_dates(day_pos)
+
+    def share_analysis(self, leader:'TradingAlgo'):
+        """
+        Use the analyses (and the betas) of leader instead of computing them: leader.analyse runs once per day
+        and then the trade of each variant. Only the parameters that do not change the features may differ
+        from those of the leader.
+        """
+        for name in self.FEATURE_PARAMETERS:
+            if getattr(self.algo_params, name) != getattr(leader.algo_params, name):
+                raise ValueError(f"{name} changes the shared analyses, it must be the same for every variant")
+        self.long_term_analysis = leader.long_term_analysis
+        self.short_term_analysis = leader.short_term_analysis
+        self.profiler = leader.profiler
+
+    def update_start_dates(self, day_pos:int):
+        """
+        Check if the ranking dictionary needs to be reset and move the start dates of the analyses windows
+        """
+        if self.reset_daily_ranking(day_pos): 
+            self.ranking.reset()
             # Reset daily start date to 3 months prior 
-            self.start_date_daily = datetime.strftime(datetime.strptime(date, "%Y-%m-%d") - pd.DateOffset(months=3), format="%Y-%m-%d")
+            self.start_date_daily = shift_months(self.calendar.days[day_pos], -3)
 
-        if self.reset_intraday_ranking(date): 
+        if self.reset_intraday_ranking(day_pos): 
             # Reset intraday start date to 3 months prior 
-            self.start_date_intraday = datetime.strftime(datetime.strptime(date, "%Y-%m-%d") - pd.DateOffset(months=1), format="%Y-%m-%d")
+            self.start_date_intraday = shift_months(self.calendar.days[day_pos], -1)
 
     def stop(self): 
         pass
@@ -0,0 +1,95 @@
+import numpy as np
+
+
+class RollingBetaEstimator:
+    """
+    Betas of every ticker against the index over the intraday window, from running sums.
+
+    The bar returns are those of the window days stitched together: inside a day they follow the cumulative
+    returns, the first bar of a day is linked to the last bar of the previous one, and the first bar of the
+    window has a zero return (as the pct_change of the stitched frames did). Each day keeps the sums of its own
+    bars and of its link to the previous day, so moving the window only processes the bars of the new days and the
+    beta of any portfolio costs O(portfolio size). The totals are summed again over the days of the window in order
+    instead of subtracting the sums of the expired days: a running total would depend on how the window got there
+    (e.g. days skipped by the feature store, or a resumed run) by a few ulps, and the betas feed the rankings. The
+    re-sum costs one vector add per window day, against the bars of the new day.
+    """
+    def __init__(self) -> None:
+        self.clear()
+
+    def reset_totals(self):
+        self.bars_n = 0
+        self.sum_x = 0.0   # stocks returns
+        self.sum_y = 0.0   # index returns
+        self.sum_xy = 0.0
+        self.sum_yy = 0.0
+
+    @staticmethod
+    def bar_returns(cum_rets:np.ndarray, previous:np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = cum_rets / previous - 1
+        returns[np.isnan(returns)] = 0
+        return returns
+
+    @staticmethod
+    def sums(stocks_returns:np.ndarray, index_returns:np.ndarray) -> tuple:
+        return (stocks_returns.sum(axis=0), index_returns.sum(), index_returns @ stocks_returns, index_returns @ index_returns)
+
+    def add(self, sums:tuple):
+        sum_x, sum_y, sum_xy, sum_yy = sums
+        self.sum_x = self.sum_x + sum_x
+        self.sum_y = self.sum_y + sum_y
+        self.sum_xy = self.sum_xy + sum_xy
+        self.sum_yy = self.sum_yy + sum_yy
+
+    def clear(self):
+        self.days = []
+        self.day_sums, self.link_sums, self.last_bars, self.day_bars = {}, {}, {}, {}
+        self.reset_totals()
+
+    def update(self, stocks_cumrets:dict, index_cumrets:dict):
+        """
+        Move the window to the days of stocks_cumrets / index_cumrets (bars x tickers and bars x 1 cumulative
+        returns keyed by day, in order), as returned by IntradayReturnsCache.update.
+        """
+        window = list(stocks_cumrets.keys())
+        expired = 0
+        while expired < len(self.days) and self.days[expired] not in stocks_cumrets:
+            expired += 1
+        kept = self.days[expired:]
+        if kept != window[: len(kept)]:
+            # the window did not just move forward
+            self.clear()
+            expired, kept = 0, []
+
+        for day in self.days[:expired]:
+            del self.day_sums[day], self.day_bars[day], self.last_bars[day]
+            self.link_sums.pop(day, None)
+        if kept:
+            # the new first day of the window is not linked anymore
+            self.link_sums.pop(kept[0], None)
+
+        for pos in range(len(kept), len(window)):
+            day = window[pos]
+            stocks, index = stocks_cumrets[day], index_cumrets[day][:, 0]
+            self.day_sums[day] = self.sums(self.bar_returns(stocks[1:], stocks[:-1]), self.bar_returns(index[1:], index[:-1]))
+            if pos > 0:
+                previous_stocks, previous_index = self.last_bars[window[pos - 1]]
+                self.link_sums[day] = self.sums(self.bar_returns(stocks[:1], previous_stocks), self.bar_returns(index[:1], previous_index))
+            self.last_bars[day] = (stocks[-1:], index[-1:])
+            self.day_bars[day] = len(stocks)
+
+        self.days = window
+        # not totals - expired + new, see the class docstring: the same window always gives the same bits
+        self.reset_totals()
+        for day in window:
+            self.add(self.day_sums[day])
+            if day in self.link_sums:
+                self.add(self.link_sums[day])
+            self.bars_n += self.day_bars[day]
+
+    def betas(self, columns) -> np.ndarray:
+        n = self.bars_n
+        cov = (self.sum_xy[columns] - self.sum_x[columns] * self.sum_y / n) / (n - 1)
+        index_var = (self.sum_yy - self.sum_y ** 2 / n) / (n - 1)
+        return cov / index_var
@@ -0,0 +1,38 @@
+from backtester.data.cube import IntradayCube
+
+
+class IntradayReturnsCache:
+    """
+    Per trading day cache of the intraday cumulative and pct returns.
+
+    The returns of a day only depend on the bars of that day, so each day is computed once when it
+    enters the intraday window and dropped as soon as it falls out of it.
+    """
+    def __init__(self, intraday_cube:IntradayCube, session:slice) -> None:
+        self.intraday_cube = intraday_cube
+        self.session = session
+        self.days = list(intraday_cube.day_lookup.keys())
+
+        self.cum_returns = {}
+        self.pct_returns = {}
+
+    def update(self, first_pos:int, last_pos:int):
+        """
+        Returns the cumulative and pct returns (bars x tickers arrays) of the days at positions first_pos to last_pos
+        (both included) as two dicts keyed by day. Only the days that were not already cached are computed, the ones
+        before first_pos are evicted.
+        """
+        window = self.days[first_pos : last_pos + 1]
+
+        for day in list(self.cum_returns.keys()):
+            if day not in window:
+                del self.cum_returns[day]
+                del self.pct_returns[day]
+
+        for day_pos, day in enumerate(window, start=first_pos):
+            if day not in self.cum_returns:
+                self.cum_returns[day], self.pct_returns[day] = self.intraday_cube.returns(day_pos, self.session)
+
+        cum_returns = {day: self.cum_returns[day] for day in window}
+        pct_returns = {day: self.pct_returns[day] for day in window}
+        return cum_returns, pct_returns
@@ -0,0 +1,89 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+
+class ExitRuleGrid:
+    """
+    Evaluates a grid of (take profit, stop loss, drawdown multiplier) exit rules on the portfolio path of each day.
+
+    The exits do not change the stocks selection (the drawdown cutoff depends on the average index drawdown only),
+    so a single backtest gives the result of every rule. For each day the first crossing of every threshold is
+    found with a binary search on the running max / min of the path, and the results are accumulated per rule.
+    """
+    def __init__(self, take_profits:list, stop_losses:list, drawdown_multipliers:list) -> None:
+        rules = np.array(list(itertools.product(take_profits, stop_losses, drawdown_multipliers)), dtype=float)
+        self.take_profits, self.stop_losses, self.drawdown_multipliers = rules.T
+        rules_n = len(rules)
+
+        self.days_count = 0
+        self.total_pnl = np.zeros(rules_n)
+        self.sum_ret = np.zeros(rules_n)
+        self.sum_ret2 = np.zeros(rules_n)
+        self.positive_days = np.zeros(rules_n, dtype=np.int64)
+        self.sum_drawdown = np.zeros(rules_n)
+        self.max_drawdown = np.zeros(rules_n)
+        self.sum_exit_bar = np.zeros(rules_n)
+
+    def exit_bars(self, prt_notional:np.ndarray, idx_avg_drawdown:float) -> np.ndarray:
+        """
+        Exit bar of every rule, same rules as TradingAlgo.intraday_position_management.
+        """
+        last_bar = len(prt_notional) - 1
+        perc_cumret = (prt_notional / prt_notional[0]) - 1
+
+        # the running max of the return is non decreasing: its first value above the take profit is the first crossing
+        take_profit_bars = np.searchsorted(np.maximum.accumulate(perc_cumret), self.take_profits, side="left")
+        stop_loss_bars = np.searchsorted(-np.minimum.accumulate(perc_cumret), -self.stop_losses, side="left")
+        exit_bars = np.minimum(take_profit_bars, stop_loss_bars)
+
+        if idx_avg_drawdown != 0.0:
+            drawdown = np.abs(prt_notional / np.maximum.accumulate(prt_notional) - 1)
+            # the drawdown must also be strictly positive
+            cutoffs = np.maximum(self.drawdown_multipliers * abs(idx_avg_drawdown), np.finfo(float).tiny)
+            drawdown_bars = np.searchsorted(np.maximum.accumulate(drawdown), cutoffs, side="left")
+            exit_bars = np.minimum(exit_bars, drawdown_bars)
+
+        return np.minimum(exit_bars, last_bar)
+
+    def add_day(self, prt_notional:np.ndarray, idx_avg_drawdown:float, commission:float):
+        """
+        Accumulate the results of every rule on the full session path of the portfolio.
+        """
+        exit_bars = self.exit_bars(prt_notional, idx_avg_drawdown)
+
+        pnl = prt_notional[exit_bars] - prt_notional[0] - commission
+        perc_ret = pnl / prt_notional[0]
+        # max drawdown of the path up to the exit
+        drawdown = np.abs(prt_notional / np.maximum.accumulate(prt_notional) - 1)
+        max_drawdown = np.maximum.accumulate(drawdown)[exit_bars]
+
+        self.days_count += 1
+        self.total_pnl += pnl
+        self.sum_ret += perc_ret
+        self.sum_ret2 += perc_ret ** 2
+        self.positive_days += perc_ret > 0
+        self.sum_drawdown += max_drawdown
+        self.max_drawdown = np.maximum(self.max_drawdown, max_drawdown)
+        self.sum_exit_bar += exit_bars
+
+    def results(self) -> pd.DataFrame:
+        days_n = max(self.days_count, 1)
+        avg_ret = self.sum_ret / days_n
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std_ret = np.sqrt(np.maximum(self.sum_ret2 / days_n - avg_ret ** 2, 0) * days_n / (days_n - 1))
+            sharpe = np.sqrt(252) * avg_ret / std_ret
+
+        return pd.DataFrame({
+            "take_profit": self.take_profits,
+            "stop_loss": self.stop_losses,
+            "drawdown_multiplier": self.drawdown_multipliers,
+            "pnl": self.total_pnl,
+            "avg_daily_ret": avg_ret,
+            "sharpe": sharpe,
+            "hit_ratio": self.positive_days / days_n,
+            "avg_drawdown": self.sum_drawdown / days_n,
+            "max_drawdown": self.max_drawdown,
+            "avg_exit_bar": self.sum_exit_bar / days_n,
+        })
@@ -0,0 +1,129 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+# Bump when the analyses change, so that the stored features are not reused
+FEATURE_VERSION = 2
+
+
+def array_digest(digest, values:np.ndarray):
+    values = np.asarray(values)
+    digest.update(f"{values.dtype.str}{values.shape}".encode())
+    if values.dtype == object:
+        digest.update(json.dumps([str(value) for value in values.ravel()]).encode())
+        return
+    # hash the memory as it is laid out, a column-major matrix is the C-contiguous transposed matrix
+    if not values.flags.c_contiguous:
+        values = values.T if values.flags.f_contiguous else np.ascontiguousarray(values)
+    digest.update(values.reshape(-1).view(np.uint8))
+
+
+def data_fingerprint(*arrays) -> str:
+    """
+    Content hash of the market data arrays (prices, tickers, timestamps).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for values in arrays:
+        array_digest(digest, values)
+    return digest.hexdigest()
+
+
+def parameters_hash(parameters:dict) -> str:
+    parameters = {"FEATURE_VERSION": FEATURE_VERSION, **parameters}
+    return hashlib.blake2b(json.dumps(parameters, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+class FeatureStore:
+    """
+    Outputs of the daily and intraday analyses of each day, saved as .npz files (uncompressed numpy arrays):
+
+        <store_dir>/<data fingerprint>/<parameters hash>/<YYYY-MM-DD>_<history key>.npz
+
+    The analyses carry state from one day to the next (the ewm of the intraday drawdowns and VaR), so the features
+    of a day also depend on the days analysed before it in the run: the history key chains the keys of the previous
+    days. The tickers are stored as positions in the tickers list of the data. The total size is bounded by max_mb,
+    the least recently used files (by mtime, touched on every read) are evicted first.
+    """
+    def __init__(self, store_dir:str, max_mb:float, tickers:list) -> None:
+        self.store_dir = store_dir
+        self.max_bytes = max_mb * 1024 ** 2
+        self.tickers = list(tickers)
+        self.ticker_lookup = {ticker: pos for pos, ticker in enumerate(self.tickers)}
+        self.entries = None # file -> size, scanned on the first write
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def chain_key(previous_key:str, day, start_date_daily, start_date_intraday) -> str:
+        return hashlib.blake2b(f"{previous_key}|{day}|{start_date_daily}|{start_date_intraday}".encode(), digest_size=8).hexdigest()
+
+    def feature_file(self, data_key:str, params_key:str, day, history_key:str) -> str:
+        return os.path.join(self.store_dir, data_key, params_key, f"{day}_{history_key}.npz")
+
+    def encode(self, tickers) -> np.ndarray:
+        return np.fromiter((self.ticker_lookup[ticker] for ticker in tickers), dtype=np.int32, count=len(tickers))
+
+    def decode(self, codes:np.ndarray) -> list:
+        return [self.tickers[code] for code in codes]
+
+    def get(self, feature_file:str) -> dict:
+        """
+        The stored arrays, or None.
+        """
+        try:
+            with np.load(feature_file) as data:
+                features = {name: data[name] for name in data.files}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # missing, or evicted/replaced by another process while it was read
+            self.misses += 1
+            return None
+        try:
+            os.utime(feature_file)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return features
+
+    def put(self, feature_file:str, features:dict):
+        os.makedirs(os.path.dirname(feature_file), exist_ok=True)
+        # one temporary file per writer, the workers of a sweep may write the same features at the same time
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(feature_file), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **features)
+            os.replace(tmp_file, feature_file)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+        if self.entries is None:
+            self.entries = {file: os.path.getsize(file) for file in glob.glob(os.path.join(self.store_dir, "*", "*", "*.npz"))}
+        self.entries[feature_file] = os.path.getsize(feature_file)
+        self.evict()
+
+    def evict(self):
+        total = sum(self.entries.values())
+        if total <= self.max_bytes:
+            return
+
+        def last_used(file):
+            try:
+                return os.path.getmtime(file)
+            except FileNotFoundError:
+                return 0.0
+
+        # other processes may share the store, the files they removed are just forgotten
+        for file in sorted(self.entries, key=last_used):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries.pop(file)
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
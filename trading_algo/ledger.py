@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# One row per backtest day
+DAY_DTYPE = np.dtype([
+    ("date", "datetime64[D]"),
+    ("prt_ret", "f8"),              # percentage return of the portfolio, net of commissions
+    ("prt_pnl", "f8"),
+    ("prt_gross_pnl", "f8"),
+    ("prt_commission", "f8"),
+    ("prt_vol", "f8"),              # intraday volatility over the notional
+    ("prt_max_drawdown", "f8"),     # intraday max drawdown of the day
+    ("idx_ret", "f8"),
+    ("idx_pnl", "f8"),
+    ("idx_gross_pnl", "f8"),
+    ("idx_commission", "f8"),
+    ("idx_vol", "f8"),
+    ("idx_max_drawdown", "f8"),
+    ("beta", "f8"),
+    ("avg_drawdown", "f8"),         # running values at the end of the day
+    ("idx_avg_drawdown", "f8"),
+    ("max_drawdown", "f8"),
+    ("idx_total_max_drawdown", "f8"),
+])
+
+# One row per position opened in a day
+POSITION_DTYPE = np.dtype([
+    ("date", "datetime64[D]"),
+    ("ticker", "U12"),
+    ("size", "i8"),
+    ("position", "i1"),
+    ("entry_notional", "f8"),
+    ("exit_notional", "f8"),
+    ("commission", "f8"),
+])
+
+
+class ResultsLedger:
+    """
+    Daily and per position results of a backtest in preallocated structured arrays.
+
+    The arrays are sized from the number of backtest days (see reserve) and doubled if a run goes further,
+    so that recording a day only writes one row instead of concatenating DataFrames.
+    """
+    def __init__(self, days_n:int=0, positions_per_day:int=1) -> None:
+        self.positions_per_day = positions_per_day
+        self.days = np.zeros(days_n, dtype=DAY_DTYPE)
+        self.positions = np.zeros(days_n * positions_per_day, dtype=POSITION_DTYPE)
+        self.days_count = 0
+        self.positions_count = 0
+
+    def reserve(self, days_n:int):
+        if days_n > len(self.days):
+            self.days = self._resize(self.days, days_n)
+        if days_n * self.positions_per_day > len(self.positions):
+            self.positions = self._resize(self.positions, days_n * self.positions_per_day)
+
+    @staticmethod
+    def _resize(rows:np.ndarray, size:int) -> np.ndarray:
+        resized = np.zeros(size, dtype=rows.dtype)
+        resized[: len(rows)] = rows
+        return resized
+
+    def add_day(self, **fields):
+        if self.days_count == len(self.days):
+            self.days = self._resize(self.days, max(1, 2 * len(self.days)))
+        row = self.days[self.days_count]
+        for name, value in fields.items():
+            row[name] = value
+        self.days_count += 1
+
+    def add_positions(self, date, tickers:list, sizes, signs, entry_notional, exit_notional, commissions):
+        count = len(tickers)
+        if self.positions_count + count > len(self.positions):
+            self.positions = self._resize(self.positions, max(self.positions_count + count, 2 * len(self.positions)))
+        rows = self.positions[self.positions_count : self.positions_count + count]
+        rows["date"] = date
+        rows["ticker"] = tickers
+        rows["size"] = sizes
+        rows["position"] = signs
+        rows["entry_notional"] = entry_notional
+        rows["exit_notional"] = exit_notional
+        rows["commission"] = commissions
+        self.positions_count += count
+
+    @property
+    def daily(self) -> np.ndarray:
+        return self.days[: self.days_count]
+
+    @property
+    def trades(self) -> np.ndarray:
+        return self.positions[: self.positions_count]
+
+    def daily_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.daily).set_index("date")
+
+    def trades_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.trades)
+
+    def export(self, results_dir:str, file_format:str="csv") -> list:
+        """
+        Write the daily and the trades tables to results_dir, as csv or parquet files.
+        """
+        os.makedirs(results_dir, exist_ok=True)
+        files = []
+        for name, frame in (("daily_results", self.daily_frame()), ("trades", self.trades_frame())):
+            file = os.path.join(results_dir, f"{name}.{file_format}")
+            if file_format == "parquet":
+                frame.to_parquet(file)
+            elif file_format == "csv":
+                frame.to_csv(file)
+            else:
+                raise ValueError(f"Unknown results format: {file_format}")
+            files.append(file)
+        return files
+
+    def summary(self) -> dict:
+        daily = self.daily
+        if not len(daily):
+            return {"trading_days": 0}
+
+        prt_ret = daily["prt_ret"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sharpe = np.sqrt(252) * prt_ret.mean() / prt_ret.std(ddof=1) if len(daily) > 1 else np.nan
+        return {
+            "trading_days": len(daily),
+            "avg_beta": float(np.nanmean(daily["beta"])),
+            "avg_daily_ret": float(prt_ret.mean()),
+            "sharpe": float(sharpe),
+            "hit_ratio": float((prt_ret > 0).mean()),
+            "avg_intraday_vol": float(np.nanmean(daily["prt_vol"])),
+            "idx_avg_daily_ret": float(daily["idx_ret"].mean()),
+            "trades": self.positions_count,
+        }
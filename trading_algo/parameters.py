@@ -7,9 +7,35 @@ class AlgoParameters:
     def __init__(self): 
         
         self.DAILY_EWM_WINDOW = 10 # we give more weight to the last 2 weeks
+        self.DAILY_STD_EWM_SPAN = 10 # ewm std of the daily returns (trend stability)
+        self.INTRADAY_EWM_SPAN = 5 # 1 week smoothing of the intraday drawdown and VaR
+        self.INCREMENTAL_DAILY_SIGNAL = True # update the daily ewm day by day instead of recomputing the whole window
         
         self.LONG_TREND_DAYS = 120
         self.RANKING_DAYS = 10
         self.RESHUFFLE_FREQUENCY = 1
 
-        self.INCLUDE_INDEX = False
\ No newline at end of file
+        self.INCLUDE_INDEX = False
+
+        # Integer weights of the daily and of the intraday rankings in the total ranking (Borda points multipliers)
+        self.DAILY_RANK_WEIGHT = 1
+        self.INTRADAY_RANK_WEIGHT = 1
+
+        # Intraday session used for the analysis and the trading
+        self.SESSION_START = "09:35:00"
+        self.SESSION_END = "15:45:00"
+
+        # Bar size in minutes of the intraday analysis and of the execution (None for the bars of the data, 2 minutes
+        # for the downloaded data): coarser bars are resampled from the data, e.g. 15 minutes bars for the analysis
+        # and the data bars for the execution
+        self.ANALYSIS_BAR_MINUTES = None
+        self.EXECUTION_BAR_MINUTES = None
+
+        # Intraday exits of the portfolio
+        self.TAKE_PROFIT = 0.006
+        self.STOP_LOSS = -0.003
+        self.DRAWDOWN_MULTIPLIER = 0.6 # exit when the drawdown reaches this share of the average index drawdown
+
+        # "batch" simulates the whole session at once, "streaming" receives the intraday bars one by one
+        # from the Backtester and stops reading the day when the portfolio is closed
+        self.EXECUTION_MODE = "batch"
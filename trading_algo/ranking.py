@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class RankingEngine:
+    """
+    Borda scores of the tickers, kept in an integer array indexed by ticker.
+
+    Every ranked list gives len(list) - i points to its i-th ticker, the scores accumulate until reset
+    (same scoring as the stocks ranking dictionary it replaces). Tickers not known at construction are added
+    when they first appear. The order in which the tickers first got a score is kept to break ties the
+    same way the dictionary did.
+    """
+    def __init__(self, tickers:list) -> None:
+        self.tickers = list(dict.fromkeys(tickers))
+        self.ticker_lookup = {ticker: pos for pos, ticker in enumerate(self.tickers)}
+        self.scores = np.zeros(len(self.tickers), dtype=np.int64)
+        self.first_scored = np.full(len(self.tickers), -1, dtype=np.int64)
+        self.scored_count = 0
+
+    def reset(self):
+        self.scores[:] = 0
+        self.first_scored[:] = -1
+        self.scored_count = 0
+
+    def positions(self, tickers) -> np.ndarray:
+        missing = [ticker for ticker in dict.fromkeys(tickers) if ticker not in self.ticker_lookup]
+        if missing:
+            for ticker in missing:
+                self.ticker_lookup[ticker] = len(self.tickers)
+                self.tickers.append(ticker)
+            self.scores = np.concatenate([self.scores, np.zeros(len(missing), dtype=np.int64)])
+            self.first_scored = np.concatenate([self.first_scored, np.full(len(missing), -1, dtype=np.int64)])
+        return np.fromiter((self.ticker_lookup[ticker] for ticker in tickers), dtype=np.int64, count=len(tickers))
+
+    def add_lists(self, ranked_lists:list, weights:list=None) -> np.ndarray:
+        """
+        Add the scores of all the lists in one step, the points of each list multiplied by its (integer) weight.
+        Returns the positions of the tickers of the last list.
+        """
+        ranked_lists = [list(ranked_list) for ranked_list in ranked_lists]
+        weights = weights if weights is not None else [1] * len(ranked_lists)
+        positions = [self.positions(ranked_list) for ranked_list in ranked_lists]
+        all_positions = np.concatenate(positions)
+        points = np.concatenate([np.arange(len(pos), 0, -1, dtype=np.int64) * int(weight) for pos, weight in zip(positions, weights)])
+        np.add.at(self.scores, all_positions, points)
+
+        # tickers scored for the first time, in the order they appear
+        unique_positions, first_index = np.unique(all_positions, return_index=True)
+        new = self.first_scored[unique_positions] == -1
+        new_positions = unique_positions[new][np.argsort(first_index[new])]
+        self.first_scored[new_positions] = self.scored_count + np.arange(len(new_positions))
+        self.scored_count += len(new_positions)
+
+        return positions[-1]
+
+    def order(self, positions:np.ndarray, top_k:int=None) -> np.ndarray:
+        """
+        Positions sorted by decreasing score, ties in the order of positions. With top_k only the best top_k are
+        selected (argpartition) and sorted.
+        """
+        # unique key: the score first, then the place in the list
+        keys = self.scores[positions] * len(positions) + np.arange(len(positions) - 1, -1, -1)
+        if top_k is not None and top_k < len(positions):
+            best = np.argpartition(-keys, top_k - 1)[:top_k] if top_k > 0 else np.array([], dtype=np.int64)
+            return positions[best[np.argsort(-keys[best])]]
+        return positions[np.argsort(-keys)]
+
+    def rank(self, ranked_lists:list, top_k:int=None, weights:list=None) -> list:
+        """
+        Add the scores of the lists and return the tickers of the last list sorted by their total score.
+        """
+        positions = self.add_lists(ranked_lists, weights)
+        return [self.tickers[pos] for pos in self.order(positions, top_k)]
+
+    def items(self, tickers:list=None) -> list:
+        """
+        (ticker, score) of the scored tickers (only those in tickers if given), by decreasing score,
+        ties in the order the tickers were first scored.
+        """
+        positions = np.flatnonzero(self.first_scored >= 0)
+        if tickers is not None:
+            positions = np.intersect1d(positions, self.positions(list(tickers)))
+        positions = positions[np.lexsort((self.first_scored[positions], -self.scores[positions]))]
+        return [(self.tickers[pos], int(self.scores[pos])) for pos in positions]
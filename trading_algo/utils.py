@@ -1,46 +1,71 @@
+import warnings
+
 import numpy as np
 import pandas as pd
 
-def rank_lists(post_analysis_lists: list[list], stocks_ranking_dictionary:dict):
-    for stock_list in post_analysis_lists:
-        max_score = len(stock_list)
-        for i, element in enumerate(stock_list):
-            if not element in stocks_ranking_dictionary:
-                stocks_ranking_dictionary[element] = max_score - i
-            else:
-                stocks_ranking_dictionary[element] += max_score - i
+def cumulative_returns(prices:np.ndarray) -> np.ndarray:
+    """
+    Cumulative returns along the first axis, a missing price gives a 0 return.
+    """
+    pct_change = np.zeros_like(prices, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct_change[1:] = prices[1:] / prices[:-1] - 1
+    pct_change[np.isnan(pct_change)] = 0
+    return np.cumprod(1 + pct_change, axis=0) - 1
 
-    ranking = pd.Series(stocks_ranking_dictionary)
+def max_drawdown(notional:np.ndarray) -> float:
+    drawdown = notional / np.maximum.accumulate(notional) - 1
+    return abs(drawdown.min())
 
-    sorted_ranking = ranking[stock_list].sort_values(ascending=False)
-    result_list = sorted_ranking.index.to_list()
+def sample_std(values:np.ndarray) -> float:
+    return values.std(ddof=1) if len(values) > 1 else np.nan
 
-    return result_list
+def daily_risk_metrics(daily_returns:pd.DataFrame, ewm_window:int, std_span:int, confidence_level=0.05) -> pd.DataFrame:
+    """
+    Cross-sectional daily metrics of every ticker, computed on the whole returns matrix at once:
+    - trend: last value of the ewm of (1 + returns)
+    - ewm_std: time average of the ewm std of the returns
+    - var: mean - percentile(1 - confidence_level) * std, ignoring the missing returns
+    """
+    trend = (1 + daily_returns).ewm(span=ewm_window).mean().iloc[-1]
+    ewm_std = daily_returns.ewm(span=std_span, min_periods=std_span).std().mean()
+    var = daily_var(daily_returns.to_numpy(), confidence_level)
 
-def value_at_risk(returns: pd.DataFrame):
-        returns.dropna(inplace=True)
-        confidence_level = 0.05
-        # Calculate the mean and standard deviation of daily returns
-        mean_return = returns.mean()
-        std_dev = returns.std()
+    return pd.DataFrame({"trend": trend, "ewm_std": ewm_std, "var": var}, index=daily_returns.columns)
 
-        # Calculate the Z-score for the confisdence level
-        z_score = np.percentile(returns, 100 * (1 - confidence_level))
-        var = mean_return - z_score * std_dev
-        return var
+def daily_var(returns:np.ndarray, confidence_level=0.05) -> np.ndarray:
+    """
+    VaR of each column of a days x tickers returns matrix, ignoring the missing returns.
+    """
+    with warnings.catch_warnings():
+        # tickers without any return get a NaN VaR
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean_return = np.nanmean(returns, axis=0)
+        std_dev = np.nanstd(returns, axis=0, ddof=1)
+        z_score = np.nanpercentile(returns, 100 * (1 - confidence_level), axis=0)
+    return mean_return - z_score * std_dev
 
-def intraday_max_drawdown(max_drawdown_df, cumul_rets_df:pd.DataFrame, stocks_df:pd.DataFrame): 
-    drawdown = (cumul_rets_df[stocks_df] / cumul_rets_df[stocks_df].cummax() - 1)
-    max_drawdown = abs(drawdown.min())
+def intraday_max_drawdown(max_drawdown_df, cumul_rets:np.ndarray, days:list, stocks:list): 
+    """
+    cumul_rets has shape days x bars x stocks, the max drawdown of each day is appended as a new column.
+    """
+    drawdown = cumul_rets / np.maximum.accumulate(cumul_rets, axis=1) - 1
+    max_drawdown = pd.DataFrame(np.abs(drawdown.min(axis=1)).T, index=stocks, columns=days)
 
     return pd.concat([max_drawdown_df, max_drawdown], axis=1)
 
-def intraday_var(day, var_df, intraday_stocks_returns:pd.DataFrame, stocks_df:pd.DataFrame, negative_returns=False): 
+def intraday_var(var_df, intraday_stocks_returns:np.ndarray, days:list, stocks:list, negative_returns=False): 
+    """
+    intraday_stocks_returns has shape days x bars x stocks, the VaR of each day is appended as a new column.
+    """
     confidence = 0.05
     returns_sign_correction = -1 if negative_returns else 1 # *-1 because we want the sign to be positive for VaR computation
-    returns = intraday_stocks_returns[day][stocks_df] * returns_sign_correction
-    zscore = np.percentile(returns ,100 * (1 - confidence))
-    mean = intraday_stocks_returns[day][stocks_df].mean()
-    std = intraday_stocks_returns[day][stocks_df].std()
-    var = mean - zscore * std
-    return pd.concat([var_df, var], axis=1)
\ No newline at end of file
+    returns = intraday_stocks_returns * returns_sign_correction
+    with warnings.catch_warnings():
+        # days or tickers without any return get a NaN VaR
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        zscore = np.nanpercentile(returns.reshape(len(days), -1), 100 * (1 - confidence), axis=1)
+        mean = np.nanmean(intraday_stocks_returns, axis=1)
+        std = np.nanstd(intraday_stocks_returns, axis=1, ddof=1)
+    var = mean - zscore[:, None] * std
+    return pd.concat([var_df, pd.DataFrame(var.T, index=stocks, columns=days)], axis=1)